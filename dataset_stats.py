@@ -0,0 +1,264 @@
+r"""This script takes a label_path image_path pair of a yolo-styled dataset, counts boxes and finds duplicate frames.
+
+Box counts and size histograms per class come from the label files.
+Near-identical images(consecutive video frames mostly) are found by perceptual hash(dHash or pHash),
+the first of every group of near-duplicates is kept.
+
+EXAMPLE:
+    python dataset_stats.py -i path_to_labels path_to_images --image_ext .jpg
+
+    Prune the train list of split_train_val.py(writes train_pruned.txt next to it), save a report:
+
+    python dataset_stats.py -i path_to_labels path_to_images --image_ext .jpg
+    --train path_to_output/train.txt --report path_to_output/stats.json
+
+    Stricter duplicates, pHash within 2 bits, 16 processes:
+
+    python dataset_stats.py -i path_to_labels path_to_images --image_ext .jpg --hash phash --threshold 2 -j 16
+"""
+
+import argparse
+import json
+import os
+from collections import defaultdict
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from split_train_val import iter_files
+
+CHUNK_SIZE = 1024  # files per task
+# relative box size(square root of the box area share) bin edges
+SIZE_BINS = (0, 1 / 64, 1 / 32, 1 / 16, 1 / 8, 1 / 4, 1 / 2, 1)
+HASH_METHODS = ('dhash', 'phash')
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def label_stats(label_files) -> tuple[np.ndarray, np.ndarray, int, int]:
+    """
+    pool task, box size histograms(class x size bin), images per class,
+    empty label files and malformed lines of label_files
+    """
+    classes, sizes, image_classes = [], [], []
+    empty, malformed = 0, 0
+    for label_file in label_files:
+        with open(label_file) as f:
+            lines = [line.split() for line in f if line.strip()]
+        if not lines:
+            empty += 1
+            continue
+        file_classes = set()
+        for line in lines:
+            try:
+                c, w, h = int(line[0]), float(line[3]), float(line[4])
+                if c < 0:
+                    raise ValueError
+            except (IndexError, ValueError):
+                malformed += 1
+                continue
+            classes.append(c)
+            sizes.append(np.sqrt(abs(w * h)))
+            file_classes.add(c)
+        image_classes += file_classes
+
+    class_count = max(classes, default=-1) + 1
+    histogram = np.zeros((class_count, len(SIZE_BINS) - 1), dtype=np.int64)
+    bins = np.clip(np.digitize(sizes, SIZE_BINS[1:-1]), 0, len(SIZE_BINS) - 2)
+    np.add.at(histogram, (np.array(classes, dtype=np.int64), bins), 1)
+    return histogram, np.bincount(image_classes, minlength=class_count), empty, malformed
+
+
+def merge_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """sum of arrays with different numbers of classes(rows)"""
+    if len(a) < len(b):
+        a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
+
+
+def dataset_stats(label_files, jobs=None) -> dict:
+    """per class box counts, images and box size histograms, counted in parallel"""
+    histogram = np.zeros((0, len(SIZE_BINS) - 1), dtype=np.int64)
+    images = np.zeros(0, dtype=np.int64)
+    empty, malformed = 0, 0
+    # multiprocessing go🚀
+    with Pool(jobs) as p:
+        for h, i, e, m in p.imap_unordered(label_stats, chunked(label_files)):
+            histogram, images = merge_rows(histogram, h), merge_rows(images, i)
+            empty, malformed = empty + e, malformed + m
+    return {
+        'labels': len(label_files),
+        'empty_labels': empty,
+        'malformed_lines': malformed,
+        'boxes': int(histogram.sum()),
+        'size_bins': SIZE_BINS,
+        'classes': {c: {'boxes': int(histogram[c].sum()), 'images': int(images[c]),
+                        'size_histogram': histogram[c].tolist()}
+                    for c in range(len(histogram)) if histogram[c].any()},
+    }
+
+
+def load_small_grey(image_file, size) -> np.ndarray | None:
+    """
+    greyscale image resized to size(width, height), None if unreadable.
+    jpeg is decoded at 1/8 resolution(in DCT domain), plenty for a hash.
+    """
+    image = cv2.imread(str(image_file), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def pack_hashes(bits: np.ndarray) -> np.ndarray:
+    """(n, 64) booleans to n uint64"""
+    return np.packbits(bits.reshape(len(bits), 64), axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def dhash(images: np.ndarray) -> np.ndarray:
+    """difference hash of (n, 8, 9) images, is each pixel brighter than its left neighbour"""
+    return pack_hashes(images[:, :, 1:] > images[:, :, :-1])
+
+
+def phash(images: np.ndarray) -> np.ndarray:
+    """perceptual hash of (n, 32, 32) images, low frequency DCT coefficients above their median"""
+    low = np.stack([cv2.dct(image.astype(np.float32))[:8, :8] for image in images]).reshape(len(images), 64)
+    # DC term left out of the median, it only follows brightness
+    return pack_hashes(low > np.median(low[:, 1:], axis=1, keepdims=True))
+
+
+HASH_FUNCTIONS = {'dhash': (dhash, (9, 8)), 'phash': (phash, (32, 32))}
+
+
+def image_hashes(image_files, method='dhash') -> tuple[np.ndarray, np.ndarray]:
+    """pool task, hashes of image_files and which of them were readable"""
+    function, size = HASH_FUNCTIONS[method]
+    images = [load_small_grey(image_file, size) for image_file in image_files]
+    readable = np.array([image is not None for image in images], dtype=bool)
+    hashes = np.zeros(len(images), dtype=np.uint64)
+    if readable.any():
+        hashes[readable] = function(np.stack([image for image in images if image is not None]))
+    return hashes, readable
+
+
+class HashIndex:
+    """
+    near-duplicate lookup of 64 bit hashes by multi-index hashing:
+    hashes are split into threshold + 1 bit ranges, two hashes at most threshold bits apart
+    are the same in at least one range, so only hashes sharing a range with the query are compared.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        bounds = [64 * i // (threshold + 1) for i in range(threshold + 2)]
+        self.ranges = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self.tables = [defaultdict(list) for _ in self.ranges]
+        self.hashes = []
+
+    def find(self, h: int) -> int | None:
+        """index of an added hash within threshold of h"""
+        for table, (shift, mask) in zip(self.tables, self.ranges):
+            for i in table.get(h >> shift & mask, ()):
+                if (h ^ self.hashes[i]).bit_count() <= self.threshold:
+                    return i
+        return None
+
+    def add(self, h: int) -> int:
+        i = len(self.hashes)
+        self.hashes.append(h)
+        for table, (shift, mask) in zip(self.tables, self.ranges):
+            table[h >> shift & mask].append(i)
+        return i
+
+
+def find_duplicates(image_files, method='dhash', threshold=3, jobs=None) -> tuple[dict[int, int], list[int]]:
+    """
+    near-duplicates in image_files(in name order, so a frame is kept, its followers are dropped),
+    returns duplicate -> kept image index and unreadable image indices
+    """
+    order = sorted(range(len(image_files)), key=lambda i: str(image_files[i]))
+    index = HashIndex(threshold)
+    kept = []  # image index of every hash in index
+    duplicates, unreadable = {}, []
+    tasks = ([image_files[i] for i in chunk] for chunk in chunked(order))
+    # multiprocessing go🚀
+    with Pool(jobs) as p:
+        results = p.imap(partial(image_hashes, method=method), tasks)
+        for chunk, (hashes, readable) in zip(chunked(order), results):
+            for i, h, ok in zip(chunk, hashes.tolist(), readable):
+                if not ok:
+                    unreadable.append(i)
+                elif (match := index.find(h)) is not None:
+                    duplicates[i] = kept[match]
+                else:
+                    index.add(h)
+                    kept.append(i)
+    return duplicates, unreadable
+
+
+def read_list(list_file: Path) -> tuple[list[str], list[Path]]:
+    """lines of a train list and the image paths(relative to the list directory)"""
+    with open(list_file) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    return lines, [list_file.parent.joinpath(line) for line in lines]
+
+
+def print_stats(stats: dict):
+    print(f'{stats["labels"]} labels({stats["empty_labels"]} empty), {stats["boxes"]} boxes, '
+          f'{stats["malformed_lines"]} malformed lines')
+    edges = ' '.join(f'<{edge:.3f}' for edge in SIZE_BINS[1:])
+    print(f'{"class":>6} {"boxes":>9} {"images":>9}  size histogram({edges})')
+    for c, class_stats in stats['classes'].items():
+        histogram = ' '.join(f'{n:>6}' for n in class_stats['size_histogram'])
+        print(f'{c:>6} {class_stats["boxes"]:>9} {class_stats["images"]:>9}  {histogram}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, action='extend', nargs='+', metavar=('label_path', 'image_path'), required=True)
+    parser.add_argument('--label_ext', type=str, default='.txt', help='label file extension name')
+    parser.add_argument('--image_ext', type=str, default='.jpg', help='image file extension name')
+    parser.add_argument('--train', type=str, help='train list to prune(all images are checked if not given)')
+    parser.add_argument('--hash', type=str, default='dhash', choices=HASH_METHODS, help='perceptual hash method')
+    parser.add_argument('--threshold', type=int, default=3,
+                        help='images within this many different hash bits are duplicates, lookups slow down above 3')
+    parser.add_argument('--report', type=str, help='write statistics to a json file')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='processes(default: cpu count)')
+    args = parser.parse_args()
+
+    label_path = Path(args.i[0])
+    image_path = Path(args.i[1]) if len(args.i) == 2 else label_path
+
+    label_files = [os.path.join(label_path, name) for _, name in iter_files(label_path, args.label_ext)]
+    stats = dataset_stats(label_files, args.jobs)
+    print_stats(stats)
+
+    if args.train:
+        lines, image_files = read_list(Path(args.train))
+    else:
+        image_files = [os.path.join(image_path, name) for _, name in iter_files(image_path, args.image_ext)]
+    duplicates, unreadable = find_duplicates(image_files, args.hash, args.threshold, args.jobs)
+    print(f'{len(duplicates)} of {len(image_files)} images are duplicates, {len(unreadable)} unreadable')
+    stats.update({'images': len(image_files), 'hash': args.hash, 'threshold': args.threshold,
+                  'duplicates': len(duplicates), 'unreadable': len(unreadable)})
+
+    if args.train:
+        pruned_path = Path(args.train).with_name(Path(args.train).stem + '_pruned.txt')
+        with open(pruned_path, 'w', buffering=1 << 20) as f:
+            f.writelines(f'{line}\n' for i, line in enumerate(lines) if i not in duplicates)
+        print(f'pruned train list: {pruned_path}')
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=1)
+
+    print('DONE!')
@@ -10,10 +10,20 @@ EXAMPLE:
     --image-ext .jpg
     --flags quality=90
     --remove-original
+
+    Shrink to at most 640 pixels on the longer side(jpeg is decoded at a reduced scale right away):
+
+    python image_format_convert.py -i path_to_images -o path_to_output --max_size 640
+
+    Lots of small images, bigger batches per worker task:
+
+    python image_format_convert.py -i path_to_images -o path_to_output --chunksize 256
 """
 
 import argparse
 import os
+import time
+from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
 
@@ -29,48 +39,119 @@ def parse_flag(s: str):
     return s
 
 
-def convert_image(image_path: Path, dir_out: Path, image_ext: str, flags: dict):
-    output_path = dir_out.joinpath(image_path.with_suffix(image_ext).name)
+CHUNK_SIZE = 64  # images per worker task
+PROGRESS_INTERVAL = 0.5  # seconds between progress line updates
+
+
+def get_target_size(image_size, size=None, max_size=None) -> tuple[int, int] | None:
+    """output size, exact size or image_size fitted into max_size, None to keep image_size"""
+    if size:
+        return tuple(size)
+    if max_size and max(image_size) > max_size:
+        ratio = max_size / max(image_size)
+        return max(1, round(image_size[0] * ratio)), max(1, round(image_size[1] * ratio))
+    return None
+
+
+def load_image(image_path: str, size=None, max_size=None) -> Image.Image:
+    """
+    RGB image of target size, decoded once at the lowest resolution that still works:
+    jpeg is decoded(and converted to RGB) at 1/2, 1/4 or 1/8 scale in the DCT domain by draft,
+    remaining integer factors are taken by reduce, before any colour conversion, then resized.
+    """
+    with Image.open(image_path) as im:
+        target = get_target_size(im.size, size, max_size)
+        if not target or target == im.size:
+            return im.convert('RGB')
+        im.draft('RGB', target)
+        # reduce averages pixel values, palette and other modes are converted first
+        if im.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            im = im.convert('RGB')
+        factor = min(im.width // target[0], im.height // target[1])
+        if factor >= 2:
+            im = im.reduce(factor)
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+        return im.resize(target, Image.LANCZOS)
+
+
+def convert_image(image_path: str, dir_out: str, image_ext: str, flags: dict, size=None, max_size=None) -> str:
+    """convert(and resize) one image to dir_out, returns the output path"""
+    name = os.path.splitext(os.path.basename(image_path))[0] + image_ext
+    output_path = os.path.join(dir_out, name)
+    rgb_im = load_image(image_path, size, max_size)
+    rgb_im.save(output_path, **flags)
+    return output_path
+
+
+def convert_task(work, image_ext, flags, size=None, max_size=None) -> tuple[str, str | None, int, int, str | None]:
+    """pool task, returns image path, output path, input and output size, error"""
+    image_path, dir_out = work
     try:
-        im = Image.open(image_path)
-        rgb_im = im.convert('RGB')
-        rgb_im.save(output_path, **flags)
+        size_in = os.path.getsize(image_path)
+        output_path = convert_image(image_path, dir_out, image_ext, flags, size, max_size)
+        return image_path, output_path, size_in, os.path.getsize(output_path), None
     except Exception as e:
-        print(f'FAIL: {image_path.stem}, {e}')
-        return False
+        return image_path, None, 0, 0, str(e)
+
 
-    print(f'OK: {image_path.stem}')
-    return True
+def iter_works(input_dirs, dir_out=None):
+    """(image path, output directory) of all files in input_dirs, scanned lazily"""
+    for input_dir in input_dirs:
+        out = dir_out if dir_out else input_dir
+        with os.scandir(input_dir) as entries:
+            if os.path.abspath(out) == os.path.abspath(input_dir):
+                # outputs are written here, take the listing first
+                entries = list(entries)
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.path, out
+
+
+def format_progress(done, failed, size, seconds):
+    seconds = max(seconds, 1e-9)
+    return f'{done} converted, {failed} failed, {done / seconds:.1f} img/s, {size / seconds / 1e6:.1f} MB/s'
 
 
 def run(args):
-    input_dirs = [Path(i) for i in args.i]
-    dir_out = Path(args.o) if args.o else None
+    input_dirs = args.i
+    dir_out = args.o
     remove_original = args.remove_original
     image_ext = args.image_ext
     flags = {(k_v := f.split('='))[0]: parse_flag(k_v[1]) for f in args.flags} if args.flags else {}
 
     if dir_out:
-        dir_out.mkdir(parents=True, exist_ok=True)
-
-    works = []
-    for input_dir in input_dirs:
-        input_path = Path(input_dir)
-        out = dir_out if dir_out else input_path
-        images = input_path.iterdir()
-        works.extend((image, out, image_ext, flags) for image in images)
+        Path(dir_out).mkdir(parents=True, exist_ok=True)
 
+    done, failed, size = 0, 0, 0
+    converted = []  # originals to remove
+    task = partial(convert_task, image_ext=image_ext, flags=flags, size=args.size, max_size=args.max_size)
+    start = last = time.perf_counter()
     # multiprocessing go🚀
-    with Pool() as p:
-        success = all(p.starmap(convert_image, works))
-        if success:
-            print('SUCCESS!')
-            if remove_original:
-                for image, *_ in works:
-                    os.remove(image)
-                print('Original images deleted')
-        else:
-            print('OOPS!')
+    with Pool(args.jobs) as p:
+        for image_path, output_path, size_in, _, error in p.imap_unordered(task, iter_works(input_dirs, dir_out),
+                                                                            chunksize=args.chunksize):
+            if error:
+                failed += 1
+                print(f'\rFAIL: {Path(image_path).stem}, {error}')
+            else:
+                done += 1
+                size += size_in
+                if remove_original and os.path.abspath(output_path) != os.path.abspath(image_path):
+                    converted.append(image_path)
+            if (now := time.perf_counter()) - last >= PROGRESS_INTERVAL:
+                last = now
+                print(f'\r{format_progress(done, failed, size, now - start)}', end='', flush=True)
+    print(f'\r{format_progress(done, failed, size, time.perf_counter() - start)}')
+
+    if failed:
+        print('OOPS!')
+        return
+    print('SUCCESS!')
+    if remove_original:
+        for image in converted:
+            os.remove(image)
+        print('Original images deleted')
 
 
 if __name__ == '__main__':
@@ -83,6 +164,11 @@ if __name__ == '__main__':
                         help='remove original images')
     parser.add_argument('-e', '--image_ext', type=str, default='.jpg', help='image file extension name(with dot)')
     parser.add_argument('-f', '--flags', type=str, action='extend', nargs='*', help='flags for image convert')
+    resize = parser.add_mutually_exclusive_group()
+    resize.add_argument('--size', type=int, nargs=2, metavar=('width', 'height'), help='resize to exactly this size')
+    resize.add_argument('--max_size', type=int, help='shrink(keeping aspect ratio) to fit the longer side in this')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes(default: cpu count)')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='images per worker task')
     args = parser.parse_args()
     print(args)
 
@@ -3,7 +3,10 @@ Primarily for solving CVAT exporting problem(too slow for large datasets),
 export labels and video respectively, use this tool to extract and arrange the frames and labels.
 
 NOTE:
-    FFmpeg is required for frame extraction.
+    FFmpeg(and ffprobe) is required for frame extraction(OpenCV for --extract seek).
+    By default(--extract pipe) ffmpeg decodes to a pipe and only the labelled frames are encoded, straight to output,
+    videos are split into keyframe aligned segments, decoded in parallel.
+    --extract select or seek also write only the labelled frames, --extract all dumps every frame first.
 
 EXAMPLE:
     python make_dataset_from_labels_and_video.py -i path_to_labels_1 path_to_video_1
@@ -11,17 +14,35 @@ EXAMPLE:
     -o path_to_output
     -image_ext .png
     -ffmpeg_exec path_to_ffmpeg
+    --extract seek
+
+    Run again after labels change, only new frames are extracted(see dataset_manifest.json in label output),
+    unchanged clips are skipped, outputs of deleted labels are removed, --rebuild to start over.
+
+    Cut videos at keyframes into segments decoded by 8 parallel ffmpeg processes(default: one per cpu core):
+
+    python make_dataset_from_labels_and_video.py -i path_to_labels path_to_video -o path_to_output -j 8
 """
 
 import argparse
+import hashlib
+import json
+import os
 import re
 import shutil
 import subprocess
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
 from dataclasses import dataclass
+from functools import partial
+from itertools import count
 from multiprocessing import Pool
 from pathlib import Path
 
+import cv2
+import numpy as np
+
 LABEL_PATTERN = re.compile(r".*?\D?(\d+)")
 
 
@@ -31,12 +52,211 @@ class Label:
     id: int  # label frame position(starting form 0)
 
 
-def extract_frames(video: Path, output_dir: Path, output_pattern, ffmpeg_exec=None) -> bool:
-    """extract all frames to output_dir using ffmpeg tool"""
+EXTRACT_MODES = ('pipe', 'select', 'seek', 'all')
+ENCODE_THREADS = 4  # image encoding threads of pipe extraction, cv2 releases the GIL while encoding
+MAX_INLINE_FILTER = 8000  # characters, longer select expressions are not passed, unneeded frames are skipped in python
+MERGE_GAP = 250  # frames, labelled frames closer than this are decoded through in one segment instead of a new seek
+SEGMENTS_PER_JOB = 2  # split into more segments than workers, so uneven segments even out
+SEEK_DISTANCE = 120  # frames, jump with a seek when the next label is further away than this, decode through otherwise
+
+
+def frame_select_expression(frame_ids) -> str:
+    """ffmpeg select filter expression matching the frame numbers, consecutive numbers are merged into ranges"""
+    frame_ids = sorted(set(frame_ids))
+    terms = []
+    start = end = frame_ids[0]
+    for frame_id in frame_ids[1:] + [None]:
+        if frame_id == end + 1:
+            end = frame_id
+            continue
+        terms.append(f'eq(n\\,{start})' if start == end else f'between(n\\,{start}\\,{end})')
+        if frame_id is not None:
+            start = end = frame_id
+    return 'select=' + '+'.join(terms)
+
+
+def extract_frames(video: Path, output_dir: Path, output_pattern, ffmpeg_exec=None, frame_ids=None) -> bool:
+    """
+    extract frames to output_dir using ffmpeg tool, all frames or only frame_ids(starting from 0),
+    output is numbered from 1 either way, the nth output is the nth of sorted frame_ids
+    """
     if not ffmpeg_exec:
         ffmpeg_exec = 'ffmpeg'
     output = output_dir.joinpath(output_pattern)
-    return subprocess.run(f'{ffmpeg_exec} -i {video.absolute()} {output}').returncode == 0
+    command = [ffmpeg_exec, '-i', str(video.absolute())]
+    if frame_ids is not None:
+        # expression can be long, passed with a file
+        filter_script = output_dir.joinpath('select.txt')
+        filter_script.write_text(frame_select_expression(frame_ids))
+        command += ['-filter_script:v', str(filter_script), '-vsync', '0']
+    return subprocess.run(command + [str(output)]).returncode == 0
+
+
+def get_ffprobe_exec(ffmpeg_exec=None) -> str:
+    """ffprobe next to ffmpeg_exec"""
+    if not ffmpeg_exec:
+        return 'ffprobe'
+    ffmpeg_exec = Path(ffmpeg_exec)
+    return str(ffmpeg_exec.with_name(ffmpeg_exec.name.replace('ffmpeg', 'ffprobe')))
+
+
+def get_video_size(video: Path, ffmpeg_exec=None) -> tuple[int, int]:
+    """width and height of the first video stream using ffprobe"""
+    command = [get_ffprobe_exec(ffmpeg_exec), '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'stream=width,height', '-of', 'csv=p=0', str(video)]
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True)
+    width, height = result.stdout.strip().split(',')[:2]
+    return int(width), int(height)
+
+
+def get_keyframes(video: Path, ffmpeg_exec=None) -> tuple[list[int], list[float]]:
+    """
+    frame numbers and seek positions(seconds from file start) of the keyframes, read from packets without decoding.
+    empty if any timestamp is missing, such video is not split.
+    """
+    command = [get_ffprobe_exec(ffmpeg_exec), '-v', 'error', '-select_streams', 'v:0', '-of', 'json',
+               '-show_entries', 'packet=pts_time,flags:format=start_time', str(video)]
+    info = json.loads(subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout)
+    packets = info.get('packets', [])
+    if not packets or any('pts_time' not in packet for packet in packets):
+        return [], []
+    # frame number is the position in presentation order
+    times = sorted((float(packet['pts_time']), 'K' in packet.get('flags', '')) for packet in packets)
+    start_time = float(info.get('format', {}).get('start_time', 0))
+    frame_duration = float(np.median(np.diff([t for t, _ in times]))) if len(times) > 1 else 0
+    frames, positions = [], []
+    for frame, (time, key) in enumerate(times):
+        if key:
+            frames.append(frame)
+            # a bit after the keyframe, ffmpeg seeks to the keyframe at or before the position
+            positions.append(time - start_time + frame_duration / 4)
+    return frames, positions
+
+
+def pipe_frames(video: Path, frame_ids, outputs, ffmpeg_exec=None, threads=ENCODE_THREADS,
+                start_frame=0, start_time=None, decode_threads=None) -> bool:
+    """
+    decode raw bgr frames from a ffmpeg pipe, encode and write frame_ids(starting from 0) to outputs on threads,
+    no temp files. frames are not auto-rotated, so they match the size reported by ffprobe.
+    with start_time, decoding starts from the keyframe start_frame at start_time(see get_keyframes).
+    ffmpeg decodes with decode_threads(default: threads).
+    """
+    width, height = get_video_size(video, ffmpeg_exec)
+    frame_size = width * height * 3
+    # numbered from where decoding starts
+    wanted = {frame_id - start_frame: output for frame_id, output in sorted(zip(frame_ids, outputs))}
+    command = [ffmpeg_exec or 'ffmpeg', '-nostdin', '-v', 'error', '-noautorotate',
+               '-threads', str(decode_threads or threads)]
+    if start_time is not None:
+        # starts right at the keyframe, nothing decoded is dropped
+        command += ['-noaccurate_seek', '-ss', f'{start_time:.6f}']
+    command += ['-i', str(video.absolute())]
+    expression = frame_select_expression(wanted)
+    # selected frames come in order, otherwise every frame comes and frame number is the position
+    selected = len(expression) <= MAX_INLINE_FILTER
+    if selected:
+        command += ['-vf', expression, '-vsync', '0']
+    command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+
+    pending = []
+    taken, written = 0, 0
+    scratch = memoryview(bytearray(frame_size))
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process, ThreadPoolExecutor(threads) as executor:
+        for position in iter(wanted) if selected else count():
+            if position not in wanted:
+                # not needed, read over it
+                if process.stdout.readinto(scratch) != frame_size:
+                    break
+                continue
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            if process.stdout.readinto(memoryview(frame).cast('B')) != frame_size:
+                break
+            taken += 1
+            pending.append(executor.submit(cv2.imwrite, str(wanted[position]), frame))
+            # bounded, decoding goes on while the oldest frames are encoded
+            if len(pending) >= threads * 2:
+                written += pending.pop(0).result()
+            if taken == len(wanted):
+                break
+        written += sum(future.result() for future in pending)
+        process.stdout.close()
+        process.wait()
+    return written == len(wanted)
+
+
+@dataclass(frozen=True)
+class Segment:
+    clip_number: int
+    video: Path
+    start_frame: int  # keyframe where decoding starts
+    start_time: float | None  # seek position of start_frame, None: from the beginning
+    frame_ids: tuple[int, ...]  # sorted
+    outputs: tuple[Path, ...]
+
+    @property
+    def cost(self) -> int:
+        """frames to decode"""
+        return self.frame_ids[-1] - self.start_frame + 1
+
+
+def plan_segments(frame_ids, keyframes, parts) -> list[tuple[int, list[int]]]:
+    """
+    split frame_ids into about `parts` (keyframe index, frame ids) segments, each decoded from its keyframe(-1: from
+    the beginning). cut only where the next keyframe comes after the last frame of the segment, so nothing is decoded
+    twice. frames within MERGE_GAP stay in one segment, unless it would be longer than its share.
+    """
+    frame_ids = sorted(set(frame_ids))
+    share = (frame_ids[-1] - frame_ids[0] + 1) / max(parts, 1)
+    segments = []  # keyframe index, start frame, frame ids
+    for frame_id in frame_ids:
+        k = bisect_right(keyframes, frame_id) - 1
+        start = keyframes[k] if k >= 0 else 0
+        if segments:
+            _, segment_start, ids = segments[-1]
+            if start <= ids[-1] or start - ids[-1] < MERGE_GAP and frame_id - segment_start < share:
+                ids.append(frame_id)
+                continue
+        segments.append((k, start, [frame_id]))
+    return [(k, ids) for k, _, ids in segments]
+
+
+def extract_segment(segment: Segment, ffmpeg_exec=None, threads=1) -> tuple[int, bool]:
+    """pool task, pipe extraction of one segment, threads are split between image encoding and ffmpeg decoding"""
+    encode_threads = max(1, threads // 2)
+    try:
+        result = pipe_frames(segment.video, segment.frame_ids, segment.outputs, ffmpeg_exec, encode_threads,
+                             segment.start_frame, segment.start_time, max(1, threads - encode_threads))
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        print(f'segment extraction failed: {segment.video} from frame {segment.start_frame}: {e}')
+        result = False
+    return segment.clip_number, result
+
+
+def grab_frames(video: Path, frame_ids, outputs) -> bool:
+    """
+    write frames(starting from 0) to outputs with OpenCV, seeks over long gaps, decodes through short ones.
+    frame accurate for constant frame rate videos.
+    """
+    capture = cv2.VideoCapture(str(video))
+    if not capture.isOpened():
+        return False
+    position = 0
+    try:
+        for frame_id, output in sorted(zip(frame_ids, outputs)):
+            if frame_id - position > SEEK_DISTANCE:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
+                position = frame_id
+            while position < frame_id:
+                if not capture.grab():
+                    return False
+                position += 1
+            ok, frame = capture.read()
+            position += 1
+            if not ok or not cv2.imwrite(str(output), frame):
+                return False
+    finally:
+        capture.release()
+    return True
 
 
 def extract_label_id(name) -> int:
@@ -60,39 +280,203 @@ def get_valid_labels(label_dir: Path, label_ext: str, ignore_empty=True) -> list
     return valid_labels
 
 
+def get_image_name(clip_number, label: Label, image_ext) -> str:
+    # numbered from 1, same as ffmpeg output
+    return f'C{clip_number:02d}_{label.id + 1:06d}{image_ext}'
+
+
+def copy_label(label: Label, label_ext, label_out: Path, image_name):
+    """copy and rename label to match image name"""
+    shutil.copy(label.path, label_out.joinpath(Path(image_name).with_suffix(label_ext).name))
+
+
 def make_dataset(label_path: Path, label_ext, label_out: Path,
                  video_path: Path, clip_number, image_out: Path, image_ext,
-                 ffmpeg_exec) -> bool:
-    # find labels
-    labels = get_valid_labels(label_path, label_ext)
+                 ffmpeg_exec, extract='pipe', labels=None) -> bool:
+    # find labels, unless given
+    if labels is None:
+        labels = get_valid_labels(label_path, label_ext)
     if not labels:
         print('no labels here, check path and extension')
         return False
 
+    if extract in ('pipe', 'seek'):
+        # straight to output, no workplace needed
+        image_names = [get_image_name(clip_number, label, image_ext) for label in labels]
+        outputs = [image_out.joinpath(name) for name in image_names]
+        frame_ids = [label.id for label in labels]
+        if extract == 'pipe':
+            result = pipe_frames(video_path, frame_ids, outputs, ffmpeg_exec)
+        else:
+            result = grab_frames(video_path, frame_ids, outputs)
+        if not result:
+            print('frame extraction failed')
+            return False
+        for label, image_name in zip(labels, image_names):
+            copy_label(label, label_ext, label_out, image_name)
+        return True
+
     # make workplace
     temp_dir = image_out.joinpath(str(uuid.uuid4()))
     temp_dir.mkdir(exist_ok=True)
 
-    result = extract_frames(video_path, temp_dir, f'C{clip_number:02d}_%06d{image_ext}', ffmpeg_exec)
+    # only labelled frames, nth output file is the nth frame id
+    frame_ids = sorted({label.id for label in labels}) if extract == 'select' else None
+    result = extract_frames(video_path, temp_dir, f'C{clip_number:02d}_%06d{image_ext}', ffmpeg_exec, frame_ids)
     if not result:
         print('frame extraction failed')
         shutil.rmtree(temp_dir)
         return False
+    output_numbers = {frame_id: i + 1 for i, frame_id in enumerate(frame_ids)} if frame_ids else None
 
     # copy label and it's correspondent image to output, rename label to match image name
     for label in labels:
         # move out of temp directory(ffmpeg output starts at 1)
-        file_name = f'C{clip_number:02d}_{label.id + 1:06d}{image_ext}'
-        image_path = temp_dir.joinpath(file_name).replace(image_out.joinpath(file_name))
+        number = output_numbers[label.id] if output_numbers else label.id + 1
+        temp_image = temp_dir.joinpath(f'C{clip_number:02d}_{number:06d}{image_ext}')
+        if not temp_image.exists():
+            print(f'frame {label.id} not found, skip label: {label.path}')
+            continue
+        image_path = temp_image.replace(image_out.joinpath(get_image_name(clip_number, label, image_ext)))
         # copy and rename label, move image
-        label_copy_to = label_out.joinpath(image_path.with_suffix(label_ext).name)
-        shutil.copy(label.path, label_copy_to)
+        copy_label(label, label_ext, label_out, image_path.name)
 
     # clean mess
     shutil.rmtree(temp_dir)
     return True
 
 
+def make_datasets_segmented(works, ffmpeg_exec=None, jobs=None) -> list[bool]:
+    """
+    pipe extraction of all clips(works as make_dataset arguments), videos are cut at keyframes into segments and spread over `jobs` workers,
+    longest segments first, every worker gets an equal share of cpu threads for decoding and encoding together.
+    """
+    jobs = jobs or os.cpu_count()
+    threads = max(1, os.cpu_count() // jobs)
+    results = {}
+    clips = {}
+    for work in works:
+        label_path, label_ext, label_out, video_path, clip_number, image_out, image_ext = work[:7]
+        labels = work[9] if len(work) > 9 else get_valid_labels(label_path, label_ext)
+        if not labels:
+            print(f'no labels here, check path and extension: {label_path}')
+            results[clip_number] = False
+            continue
+        clips[clip_number] = (labels, label_ext, label_out, video_path, image_out, image_ext)
+        results[clip_number] = True
+
+    # multiprocessing go🚀
+    with Pool(jobs) as p:
+        keyframes = p.starmap(get_keyframes, [(clip[3], ffmpeg_exec) for clip in clips.values()])
+        segments = []
+        for (clip_number, clip), (frames, positions) in zip(clips.items(), keyframes):
+            labels, _, _, video_path, image_out, image_ext = clip
+            outputs = {label.id: image_out.joinpath(get_image_name(clip_number, label, image_ext)) for label in labels}
+            for k, frame_ids in plan_segments(outputs, frames, jobs * SEGMENTS_PER_JOB):
+                start_frame, start_time = (frames[k], positions[k]) if k > 0 else (0, None)
+                segments.append(Segment(clip_number, video_path, start_frame, start_time, tuple(frame_ids),
+                                        tuple(outputs[frame_id] for frame_id in frame_ids)))
+        # longest first, a long segment never starts last
+        segments.sort(key=lambda segment: segment.cost, reverse=True)
+        task = partial(extract_segment, ffmpeg_exec=ffmpeg_exec, threads=threads)
+        for clip_number, result in p.imap_unordered(task, segments):
+            results[clip_number] &= result
+
+    for clip_number, (labels, label_ext, label_out, _, _, image_ext) in clips.items():
+        if not results[clip_number]:
+            print(f'frame extraction failed: clip {clip_number}')
+            continue
+        for label in labels:
+            copy_label(label, label_ext, label_out, get_image_name(clip_number, label, image_ext))
+    return [results[clip_number] for clip_number in sorted(results)]
+
+
+MANIFEST_NAME = 'dataset_manifest.json'
+HASH_SAMPLE = 1 << 22  # bytes hashed from each end of a video
+
+
+def get_file_state(path: Path) -> dict:
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def hash_video(video: Path) -> str:
+    """sha1 of the size, the first and the last HASH_SAMPLE bytes, tells videos apart without reading all of them"""
+    size = video.stat().st_size
+    sha1 = hashlib.sha1(str(size).encode())
+    with open(video, 'rb') as f:
+        sha1.update(f.read(HASH_SAMPLE))
+        f.seek(max(size - HASH_SAMPLE, 0))
+        sha1.update(f.read(HASH_SAMPLE))
+    return sha1.hexdigest()
+
+
+def get_video_state(video: Path, entry=None) -> dict:
+    """size, mtime and hash of video, the hash is reused from the manifest entry if size and mtime did not change"""
+    state = get_file_state(video)
+    if entry and entry['size'] == state['size'] and entry['mtime'] == state['mtime']:
+        state['hash'] = entry['hash']
+    else:
+        state['hash'] = hash_video(video)
+    return state
+
+
+def load_manifest(path: Path) -> dict:
+    if not path.is_file():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path: Path, manifest: dict):
+    """write to a temp file then replace, an interrupted save keeps the old manifest"""
+    temp = path.with_name(path.name + '.tmp')
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    temp.replace(path)
+
+
+def plan_clip_update(entry, video_state, labels, clip_number, image_ext, label_ext, image_out: Path, label_out: Path):
+    """
+    compare the labels of a clip with its manifest entry,
+    returns labels needing their frame, labels to copy only, unchanged label records and outputs to remove.
+    a changed video or image_ext makes every label need its frame.
+    """
+    same_video = entry and entry['hash'] == video_state['hash'] and entry['image_ext'] == image_ext
+    records = entry.get('labels', {}) if same_video else {}
+    to_extract, to_copy, unchanged = [], [], {}
+    produced = set()
+    for label in labels:
+        image_name = get_image_name(clip_number, label, image_ext)
+        label_name = Path(image_name).with_suffix(label_ext).name
+        produced.update((image_name, label_name))
+        record = records.get(label.path.name)
+        if not record or record['image'] != image_name or not image_out.joinpath(image_name).exists():
+            to_extract.append(label)
+        elif record['label'] != label_name or not label_out.joinpath(label_name).exists() \
+                or {k: record[k] for k in ('size', 'mtime')} != get_file_state(label.path):
+            to_copy.append(label)
+        else:
+            unchanged[label.path.name] = record
+    # outputs of deleted labels, all old outputs if the video changed(same names are overwritten)
+    return to_extract, to_copy, unchanged, get_stale_outputs(entry, produced, image_out, label_out)
+
+
+def get_stale_outputs(entry, produced, image_out: Path, label_out: Path) -> list[Path]:
+    """outputs recorded in the manifest entry that are not in produced(file names)"""
+    removed = []
+    for record in (entry or {}).get('labels', {}).values():
+        removed += [image_out.joinpath(record['image'])] if record['image'] not in produced else []
+        removed += [label_out.joinpath(record['label'])] if record['label'] not in produced else []
+    return removed
+
+
+def get_label_record(clip_number, label: Label, image_ext, label_ext) -> dict:
+    image_name = get_image_name(clip_number, label, image_ext)
+    return {'id': label.id, **get_file_state(label.path),
+            'image': image_name, 'label': Path(image_name).with_suffix(label_ext).name}
+
+
 def run(args):
     label_out = Path(args.o[0])
     label_out.mkdir(parents=True, exist_ok=True)
@@ -102,18 +486,69 @@ def run(args):
     label_ext = args.label_ext
     image_ext = args.image_ext
     ffmpeg_exec = args.ffmpeg_exec
+    extract = args.extract
+
+    # what is already built, rebuild everything if asked
+    manifest_path = label_out.joinpath(MANIFEST_NAME)
+    manifest = {} if args.rebuild else load_manifest(manifest_path)
+    clip_entries = manifest.setdefault('clips', {})
 
     works = []
+    result = []
+    updates = {}
     for clip_number, (label_path, video_path) in enumerate(args.i):
         label_path, video_path = Path(label_path), Path(video_path)
-        works.append((label_path, label_ext, label_out,
-                      video_path, clip_number, image_out, image_ext,
-                      ffmpeg_exec,))
+        labels = get_valid_labels(label_path, label_ext)
+        entry = clip_entries.get(str(clip_number))
+        if not labels and entry:
+            # every label deleted, so are the outputs
+            removed = get_stale_outputs(entry, set(), image_out, label_out)
+            for path in removed:
+                path.unlink(missing_ok=True)
+            del clip_entries[str(clip_number)]
+            print(f'clip {clip_number}: all labels deleted, {len(removed)} removed')
+            continue
+        if not labels:
+            print(f'no labels here, check path and extension: {label_path}')
+            result.append(False)
+            continue
+        video_state = get_video_state(video_path, entry)
+        to_extract, to_copy, unchanged, removed = plan_clip_update(entry, video_state, labels, clip_number,
+                                                                   image_ext, label_ext, image_out, label_out)
+        for path in removed:
+            path.unlink(missing_ok=True)
+        for label in to_copy:
+            copy_label(label, label_ext, label_out, get_image_name(clip_number, label, image_ext))
+        unchanged.update({label.path.name: get_label_record(clip_number, label, image_ext, label_ext)
+                          for label in to_copy})
+        updates[clip_number] = (video_path, video_state, unchanged, to_extract)
+        print(f'clip {clip_number}: {len(to_extract)} to extract, {len(to_copy)} to copy, '
+              f'{len(unchanged) - len(to_copy)} unchanged, {len(removed)} removed')
+        if to_extract:
+            works.append((label_path, label_ext, label_out,
+                          video_path, clip_number, image_out, image_ext,
+                          ffmpeg_exec, extract, to_extract,))
 
-    # multiprocessing go🚀
-    with Pool() as p:
-        result = p.starmap(make_dataset, works)
-        print('SUCCESS!' if all(result) else 'OOPS!')
+    if extract == 'pipe':
+        extracted = make_datasets_segmented(works, ffmpeg_exec, args.jobs)
+    else:
+        # multiprocessing go🚀
+        with Pool(args.jobs) as p:
+            extracted = p.starmap(make_dataset, works)
+    extracted = {work[4]: success for work, success in zip(works, extracted)}
+
+    # record what is in output now, a failed clip keeps only its outputs that are still valid
+    for clip_number, (video_path, video_state, records, to_extract) in updates.items():
+        success = extracted.get(clip_number, True)
+        if success:
+            records.update({label.path.name: get_label_record(clip_number, label, image_ext, label_ext)
+                            for label in to_extract})
+        records = {name: record for name, record in records.items() if image_out.joinpath(record['image']).exists()}
+        clip_entries[str(clip_number)] = {'video': str(video_path), **video_state, 'image_ext': image_ext,
+                                          'labels': records}
+        result.append(success)
+    save_manifest(manifest_path, manifest)
+    print('SUCCESS!' if all(result) else 'OOPS!')
 
 
 if __name__ == '__main__':
@@ -125,6 +560,15 @@ if __name__ == '__main__':
     parser.add_argument('--label_ext', type=str, default='.txt', help='label file extension name(with dot)')
     parser.add_argument('--image_ext', type=str, default='.bmp', help='image file extension name(with dot)')
     parser.add_argument('--ffmpeg_exec', type=str, help='specify a ffmpeg executable')
+    parser.add_argument('--extract', type=str, default='pipe', choices=EXTRACT_MODES,
+                        help='pipe: ffmpeg decodes to a pipe, labelled frames are encoded to output, '
+                             'select: ffmpeg writes labelled frames only, seek: OpenCV seeks to labelled frames, '
+                             'all: ffmpeg writes every frame')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes(default: cpu count), pipe mode splits the cpu threads among them, '
+                             'a worker shares its threads between ffmpeg decoding and image encoding')
+    parser.add_argument('--rebuild', default=False, action=argparse.BooleanOptionalAction,
+                        help=f'ignore {MANIFEST_NAME} in label_out, extract every frame again')
     args = parser.parse_args()
 
     print(args)
@@ -5,16 +5,60 @@ EXAMPLE
     Compress RGB image with jpeg of quality 30, compress greyscale image with otsu method, skip page 1, 2, 3, 24:
 
     python pdf_tool.py path_to_input.pdf path_to_output.pdf --quality 30 --otsu --pages skip 1-3 24
+
+    Use 4 processes for image re-encoding:
+
+    python pdf_tool.py path_to_input.pdf path_to_output.pdf --jobs 4
+
+    Compress a directory tree of pdf files with 8 processes, results in compressed/compress_summary.jsonl:
+
+    python pdf_tool.py path_to_pdfs path_to_compressed --otsu --bilevel g4 --jobs 8
+
+    Compress in place, save quickly(bigger file than the default full save):
+
+    python pdf_tool.py path_to_input.pdf path_to_input.pdf --save fast
+
+    Unevenly lit scans, local thresholds:
+
+    python pdf_tool.py path_to_input.pdf path_to_output.pdf --threshold_method sauvola --bilevel g4
+
+    Let every image get the encoding that fits(text scans to black and white, grey/colour jpeg or kept),
+    limit resolution to 200dpi:
+
+    python pdf_tool.py path_to_input.pdf path_to_output.pdf --plan --otsu --target_dpi 200
+
+    Store black and white pages as CCITT Group 4:
+
+    python pdf_tool.py path_to_input.pdf path_to_output.pdf --otsu --bilevel g4
+
+    Compare image write back methods / bilevel encoders:
+
+    python -c "import pdf_compress; pdf_compress.benchmark_replace('path_to_input.pdf')"
+    python -c "import pdf_compress; pdf_compress.benchmark_bilevel('path_to_input.pdf', otsu=True)"
 """
 
 import argparse
+import hashlib
 import io
+import json
+import logging
+import time
+import zlib
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+
 import fitz
 
 import cv2
 import numpy as np
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
 
 def get_page_config(parameters: list[str]):
     """return page number starts from 0"""
@@ -51,86 +95,556 @@ def quantize(source: Image.Image, colors):
     return source.quantize(colors)
 
 
-def threshold_otsu(source):
-    image_size = source.size
+# local thresholding: neighbourhood size(odd, pixels), offset for adaptive, k and dynamic range for sauvola
+LOCAL_BLOCK_SIZE = 51
+ADAPTIVE_OFFSET = 20
+SAUVOLA_K = 0.2
+SAUVOLA_R = 128
+
+
+def to_grey_array(source: Image.Image) -> np.ndarray:
+    """8 bit grey pixels, a view of the decoded buffer for 'L' images, other modes(P, CMYK, LA, 1...) go through PIL"""
     if source.mode == 'L':
-        source_grey = np.array(source)
-    elif source.mode == 'RGB':
-        source_grey = cv2.cvtColor(np.array(source), cv2.COLOR_RGB2GRAY)
-    else:
-        raise TypeError(f'not supported mode: {source.mode}')
+        return np.asarray(source)
+    if source.mode == 'RGB':
+        return cv2.cvtColor(np.asarray(source), cv2.COLOR_RGB2GRAY)
+    return np.asarray(source.convert('L'))
+
+
+def binarize(grey: np.ndarray, method='normal', threshold=127, block_size=LOCAL_BLOCK_SIZE) -> np.ndarray:
+    """
+    Threshold a grey array, True is white.
+    normal: fixed threshold; otsu: global otsu threshold; adaptive: local mean - ADAPTIVE_OFFSET;
+    sauvola: local mean * (1 + k * (local std / R - 1)), for unevenly lit scans
+    """
+    match method:
+        case 'normal':
+            return grey > threshold
+        case 'otsu':
+            otsu_threshold, _ = cv2.threshold(grey, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return grey > otsu_threshold
+        case 'adaptive':
+            return cv2.adaptiveThreshold(grey, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                         block_size, ADAPTIVE_OFFSET).view(np.bool_)
+        case 'sauvola':
+            grey_float = grey.astype(np.float32)
+            mean = cv2.boxFilter(grey_float, -1, (block_size, block_size))
+            mean_square = cv2.boxFilter(grey_float * grey_float, -1, (block_size, block_size))
+            std = np.sqrt(np.maximum(mean_square - mean * mean, 0))
+            return grey_float > mean * (1 + SAUVOLA_K * (std / SAUVOLA_R - 1))
+        case _:
+            raise ValueError(f'unknown threshold method: {method}')
 
-    ret, th = cv2.threshold(source_grey, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    image = Image.frombuffer('L', image_size, th, 'raw', 'L', 0, 1)
-    return image.convert('1')
 
+def pack_bits(white: np.ndarray) -> np.ndarray:
+    """rows of 1 bit pixels, MSB first, padded to whole bytes, 1 is white: PDF DeviceGray and PIL '1' layout"""
+    return np.packbits(white, axis=1)
 
-def threshold_normal(source: Image.Image, threshold=127):
-    return source.convert('L').point(lambda x: x > threshold, mode='1')
 
+def bits_to_image(packed: np.ndarray, width) -> Image.Image:
+    return Image.frombuffer('1', (width, packed.shape[0]), packed, 'raw', '1', 0, 1)
 
-# noinspection PyUnresolvedReferences
-def compress(in_file, out_file, handle_types, otsu, binary, page_filter, threshold, quality):
-    doc = fitz.Document(in_file)
-    print(doc.metadata)
 
+def threshold_otsu(source):
+    return bits_to_image(pack_bits(binarize(to_grey_array(source), 'otsu')), source.width)
+
+
+def threshold_normal(source: Image.Image, threshold=127):
+    return bits_to_image(pack_bits(binarize(to_grey_array(source.convert('L')), 'normal', threshold)), source.width)
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """image stream ready to be written into a PDF image object"""
+    data: bytes
+    width: int
+    height: int
+    colorspace: str
+    bpc: int
+    filter: str
+    decode_parms: str = 'null'
+
+    def to_file_bytes(self):
+        """standalone image file, for page.insert_image"""
+        if self.filter == '/DCTDecode':
+            return self.data
+        if self.filter != '/FlateDecode':
+            raise ValueError(f'no image file for {self.filter} streams')
+        image = Image.frombytes('1', (self.width, self.height), zlib.decompress(self.data))
+        image_bytes = io.BytesIO()
+        image.save(image_bytes, 'png', compress_level=0)
+        return image_bytes.getvalue()
+
+
+def encode_bilevel_flate(packed: np.ndarray, width):
+    return EncodedImage(zlib.compress(packed.tobytes()), width, packed.shape[0], '/DeviceGray', 1, '/FlateDecode')
+
+
+TIFF_STRIP_OFFSETS, TIFF_ROWS_PER_STRIP, TIFF_STRIP_BYTE_COUNTS = 273, 278, 279
+
+
+def encode_bilevel_g4(packed: np.ndarray, width):
+    """CCITT Group 4, encoded by Pillow's libtiff as a single strip TIFF, the strip is the PDF stream"""
+    height = packed.shape[0]
+    tiff = io.BytesIO()
+    bits_to_image(packed, width).save(tiff, 'tiff', compression='group4', tiffinfo={TIFF_ROWS_PER_STRIP: height})
+    tiff.seek(0)
+    with Image.open(tiff) as t:
+        (offset,), (count,) = t.tag_v2[TIFF_STRIP_OFFSETS], t.tag_v2[TIFF_STRIP_BYTE_COUNTS]
+    # Pillow writes '1' images as min-is-black, libtiff codes 1 bits as black runs
+    parms = f'<</K -1/Columns {width}/Rows {height}/BlackIs1 true>>'
+    return EncodedImage(tiff.getvalue()[offset:offset + count], width, height, '/DeviceGray', 1,
+                        '/CCITTFaxDecode', parms)
+
+
+BILEVEL_ENCODERS = {
+    'flate': encode_bilevel_flate,
+    'g4': encode_bilevel_g4,
+}
+
+
+def encode_jpeg(image: Image.Image, quality):
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, 'jpeg', quality=quality)
+    colorspace = '/DeviceGray' if image.mode == 'L' else '/DeviceRGB'
+    return EncodedImage(image_bytes.getvalue(), image.width, image.height, colorspace, 8, '/DCTDecode')
+
+
+# planner: downsampled copy size, mean channel spread above which an image counts as colour,
+# otsu separability(between class / total variance) above which a grey image with mostly bright
+# background counts as a text scan
+PLAN_SAMPLE_SIZE = 512
+PLAN_COLOR_CHROMA = 12
+PLAN_BILEVEL_SEPARABILITY = 0.8
+
+
+def histogram_separability(histogram: np.ndarray):
+    """best otsu separability of a 256 bin histogram, and the share of pixels above that threshold"""
+    p = histogram / histogram.sum()
+    levels = np.arange(len(p))
+    weights, means = np.cumsum(p), np.cumsum(p * levels)
+    total_mean = means[-1]
+    between = (total_mean * weights - means) ** 2 / np.maximum(weights * (1 - weights), 1e-12)
+    variance = (p * (levels - total_mean) ** 2).sum()
+    best = int(np.argmax(between))
+    return (between[best] / variance if variance else 0.), 1 - weights[best]
+
+
+def plan_image(image: Image.Image):
+    """pick 'bilevel', 'gray' or 'color' encoding, judging from a downsampled copy"""
+    sample = image.copy()
+    sample.thumbnail((PLAN_SAMPLE_SIZE, PLAN_SAMPLE_SIZE))
+    if sample.mode != 'L':
+        pixels = np.asarray(sample.convert('RGB'), dtype=np.int16)
+        if (pixels.max(axis=2) - pixels.min(axis=2)).mean() > PLAN_COLOR_CHROMA:
+            return 'color'
+    histogram = np.bincount(np.asarray(sample.convert('L')).ravel(), minlength=256)
+    separability, bright = histogram_separability(histogram)
+    return 'bilevel' if separability > PLAN_BILEVEL_SEPARABILITY and bright > 0.5 else 'gray'
+
+
+def recompress_image(image_bytes: bytes, handle_types, threshold_method, binary, threshold, quality,
+                     bilevel='flate', plan=False, scale=1., raw_size=None, block_size=LOCAL_BLOCK_SIZE):
+    """
+    decode and re-encode one image, returns (EncodedImage or None if skipped, image mode / plan note)
+    scale < 1 downsamples first, with plan the encoding is chosen per image and kept only when smaller than raw_size
+    """
+    image_original = Image.open(io.BytesIO(image_bytes))
+    mode = image_original.mode
+    if mode not in handle_types:
+        return None, mode
+
+    if scale < 1:
+        size = max(round(image_original.width * scale), 1), max(round(image_original.height * scale), 1)
+        image_original = image_original.resize(size, Image.LANCZOS)
+
+    def encode_bilevel():
+        white = binarize(to_grey_array(image_original), threshold_method, threshold, block_size)
+        return BILEVEL_ENCODERS[bilevel](pack_bits(white), image_original.width)
+
+    if not plan:
+        if binary or mode == 'L':
+            return encode_bilevel(), mode
+        # image_new = quantize(image_original, colors)
+        return encode_jpeg(image_original, quality), mode
+
+    kind = 'bilevel' if binary else plan_image(image_original)
+    if kind == 'bilevel':
+        encoded = encode_bilevel()
+    else:
+        encoded = encode_jpeg(image_original.convert('L' if kind == 'gray' else 'RGB'), quality)
+    note = f'{mode} -> {kind}, {raw_size} -> {len(encoded.data)} bytes'
+    if raw_size is not None and len(encoded.data) >= raw_size:
+        return None, note + ', not smaller'
+    return encoded, note
+
+
+def replace_image_stream(doc, page_idx, xref, image: EncodedImage):
+    """write the new stream and its image dictionary entries straight into the existing object"""
+    doc.update_stream(xref, image.data, compress=False)
+    for key, value in (('Filter', image.filter), ('DecodeParms', image.decode_parms),
+                       ('ColorSpace', image.colorspace), ('BitsPerComponent', str(image.bpc)),
+                       ('Width', str(image.width)), ('Height', str(image.height)), ('Decode', 'null')):
+        doc.xref_set_key(xref, key, value)
+
+
+def replace_image_insert(doc, page_idx, xref, image: EncodedImage):
+    """insert as a new image, copy over the original object and delete the new one, the former approach"""
+    page = doc[page_idx]
+    new_xref = page.insert_image(page.rect, stream=image.to_file_bytes())
+    doc.xref_copy(new_xref, xref)
+    doc._deleteObject(new_xref)
+
+
+REPLACE_METHODS = {
+    'stream': replace_image_stream,
+    'insert': replace_image_insert,
+}
+
+
+def _recompress_task(task, target_dpi=None, **options):
+    page_idx, xref, image_bytes, raw_size, dpi = task
+    scale = target_dpi / dpi if target_dpi and dpi else 1.
+    return page_idx, xref, *recompress_image(image_bytes, scale=scale, raw_size=raw_size, **options)
+
+
+def get_image_dpi(page, image_info):
+    """effective resolution where the image is shown biggest on page, None if not shown"""
+    areas = [r.width * r.height for r in page.get_image_rects(image_info[0])]
+    if not areas or max(areas) <= 0:
+        return None
+    # by area, so rotated placements count the same
+    return (image_info[2] * image_info[3] / max(areas)) ** 0.5 * 72
+
+
+def find_images(doc, page_filter, measure_dpi=False):
+    """
+    (page index, xref) of images to process, every xref appears once,
+    all (referencer xref, image name, xref) references to them, image infos,
+    and the lowest effective dpi of every image if measure_dpi
+    """
+    targets, references, infos, dpis = [], [], {}, {}
     for page_idx, page in enumerate(doc.pages()):
-        print(page_idx, page)
+        logger.debug(f'{page_idx} {page}')
 
         if not page_filter(page_idx):
-            print(f'skip page: {page_idx}')
+            logger.debug(f'skip page: {page_idx}')
             continue
 
-        for image_info in page.get_images():
+        for image_info in page.get_images(full=True):
             # (xref, smask, width, height, bpc, colorspace, alt.colorspace, name, filter, referencer)
-            # image_info: (7, 0, 1222, 1680, 8, 'DeviceRGB', '', 'I0', 'DCTDecode')
-            print(image_info)
+            # image_info: (7, 0, 1222, 1680, 8, 'DeviceRGB', '', 'I0', 'DCTDecode', 0)
+            logger.debug(image_info)
             xref = image_info[0]
+            # referencer 0: the page itself
+            references.append((image_info[9] or page.xref, image_info[7], xref))
+            if xref not in infos:
+                infos[xref] = image_info
+                targets.append((page_idx, xref))
+            if measure_dpi and (dpi := get_image_dpi(page, image_info)):
+                dpis[xref] = min(dpis.get(xref, dpi), dpi)
+    return targets, references, infos, dpis
+
+
+@dataclass
+class DedupReport:
+    references: int = 0  # image references on processed pages
+    xrefs: int = 0  # distinct image objects
+    unique: int = 0  # distinct image contents
+    bytes_saved: int = 0  # input stream bytes of merged duplicate objects
+
+    def __str__(self):
+        return (f'images: {self.references} references, {self.xrefs} objects, {self.unique} unique, '
+                f'saved {self.references - self.unique} re-encodes and {self.bytes_saved} bytes')
+
+
+IMAGE_DRAW_KEYS = ('Decode', 'DecodeParms', 'ImageMask', 'Mask')
+
+
+def find_duplicates(doc, targets, infos):
+    """map xrefs with identical stream and image parameters to the first one of them, and the duplicate bytes"""
+    canonical, duplicates, duplicate_bytes = {}, {}, 0
+    for _, xref in targets:
+        stream = doc.xref_stream_raw(xref)
+        # smask, width, height, bpc, colorspace, alt.colorspace and filter have to match as well,
+        # and the dictionary entries that change how the same bytes are drawn
+        info = infos[xref]
+        key = (hashlib.sha1(stream).digest(), *info[1:7], info[8],
+               *(doc.xref_get_key(xref, name) for name in IMAGE_DRAW_KEYS))
+        if key in canonical:
+            duplicates[xref] = canonical[key]
+            duplicate_bytes += len(stream)
+        else:
+            canonical[key] = xref
+    return duplicates, duplicate_bytes
+
+
+def set_xobject_reference(doc, referencer, name, xref):
+    """point resource XObject `name` of referencer(page or form) to xref"""
+    # a page without its own Resources inherits them from the page tree, a new page level
+    # Resources would hide everything else it inherits, so edit the node that defines them
+    target = referencer
+    while doc.xref_get_key(target, 'Resources')[0] == 'null':
+        kind, parent = doc.xref_get_key(target, 'Parent')
+        if kind != 'xref':
+            target = referencer
+            break
+        target = int(parent.split()[0])
+    path = []
+    for key in ('Resources', 'XObject'):
+        kind, value = doc.xref_get_key(target, '/'.join(path + [key]))
+        # follow indirect objects, xref_set_key does not handle them in paths
+        if kind == 'xref':
+            target, path = int(value.split()[0]), []
+        else:
+            path.append(key)
+    doc.xref_set_key(target, '/'.join(path + [name]), f'{xref} 0 R')
+
+
+def extract_images(doc, targets, dpis):
+    for page_idx, xref in targets:
+        # image = {'ext': 'jpeg', 'smask': 0, 'width': 1222, 'height': 1680, 'colorspace': 3, 'bpc': 8, 'xres': 96,
+        #          'yres': 96, 'cs-name': 'DeviceRGB', 'image': b''}
+        yield page_idx, xref, doc.extract_image(xref)['image'], len(doc.xref_stream_raw(xref)), dpis.get(xref)
 
-            # image = {'ext': 'jpeg', 'smask': 0, 'width': 1222, 'height': 1680, 'colorspace': 3, 'bpc': 8, 'xres': 96,
-            #          'yres': 96, 'cs-name': 'DeviceRGB', 'image': b''}
-            image = doc.extract_image(xref)
-
-            image_original = Image.open(io.BytesIO(image['image']))
-            if image_original.mode not in handle_types:
-                print(f'skip image: xref[{xref}]: {image_original.mode}')
-                continue
-
-            image_new_bytes = io.BytesIO()
 
-            if binary or image_original.mode == 'L':
-                image_new = threshold_otsu(image_original) if otsu else threshold_normal(image_original, threshold)
-                image_new.save(image_new_bytes, 'png', compress_level=0)
-            else:
-                # image_new = quantize(image_original, colors)
-                image_original.save(image_new_bytes, 'jpeg', quality=quality)
+# noinspection PyUnresolvedReferences
+SAVE_OPTIONS = {
+    # smallest output: drop unused and duplicate objects, clean and deflate content
+    'full': dict(garbage=4, clean=True, deflate=True),
+    # only drop unused objects(replaced duplicates)
+    'fast': dict(garbage=1),
+    # append changes to the input file, old image streams stay in the file until a full save
+    'incremental': dict(incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP),
+}
+
+
+def save_document(doc, out_file, save='full'):
+    """
+    Write doc to out_file(path or binary file object) without building the whole output in memory.
+    Saving to the input path goes through a temporary file, except for incremental saves which require it.
+    """
+    options = SAVE_OPTIONS[save]
+    if isinstance(out_file, (str, Path)):
+        out_path = Path(out_file)
+        same_file = bool(doc.name) and Path(doc.name).exists() and out_path.exists() and \
+                    out_path.samefile(doc.name)
+        if save == 'incremental':
+            if not same_file or not doc.can_save_incrementally():
+                raise ValueError('incremental save needs the output to be the input file, and a file that allows it')
+            doc.save(doc.name, **options)
+        elif same_file:
+            temp = out_path.with_name(out_path.name + '.tmp')
+            doc.save(temp, **options)
+            doc.close()
+            temp.replace(out_path)
+        else:
+            doc.save(out_path, **options)
+    else:
+        if save == 'incremental':
+            raise ValueError('incremental save needs the output to be the input file')
+        doc.save(out_file, **options)
+
+
+def compress(in_file, out_file, handle_types, otsu, binary, page_filter, threshold, quality, jobs=1,
+             replace='stream', save='full', bilevel='flate', plan=False, target_dpi=None,
+             threshold_method=None, block_size=LOCAL_BLOCK_SIZE):
+    """
+    Images are extracted on the main process, decoded and re-encoded by `jobs` worker processes,
+    then written back in the original order, so the output does not depend on `jobs`.
+    in_file and out_file are paths or binary file objects, see save_document for `save`.
+    With plan, every image gets the encoding that suits it(see plan_image) and is replaced only if it gets smaller.
+    Images shown at more than target_dpi are downsampled to it.
+    threshold_method(see binarize) defaults to otsu or normal, following the otsu flag.
+    Returns statistics: page and image counts and seconds spent per stage.
+    """
+    if replace == 'insert' and bilevel != 'flate':
+        # checked before the document is touched, insert_image takes image files only
+        raise ValueError(f'replace insert cannot write {bilevel} images, use replace stream')
+    stats = {'pages': 0, 'pages_processed': 0, 'images': 0, 'unique_images': 0, 'replaced': 0, 'skipped': 0,
+             'seconds': {}}
+    start = time.perf_counter()
+
+    def lap(stage):
+        nonlocal start
+        now = time.perf_counter()
+        stats['seconds'][stage] = round(now - start, 4)
+        start = now
 
-            new_xref = page.insert_image(page.rect, stream=image_new_bytes)
-            doc.xref_copy(new_xref, xref)
-            doc._deleteObject(new_xref)
+    doc = fitz.Document(in_file)
+    logger.debug(doc.metadata)
+    stats['pages'] = doc.page_count
+    stats['pages_processed'] = sum(map(page_filter, range(doc.page_count)))
+    lap('open')
+
+    targets, references, infos, dpis = find_images(doc, page_filter, measure_dpi=bool(target_dpi))
+    lap('scan')
+    duplicates, duplicate_bytes = find_duplicates(doc, targets, infos)
+    report = DedupReport(len(references), len(targets), len(targets) - len(duplicates), duplicate_bytes)
+    stats['images'], stats['unique_images'] = report.references, report.unique
+    targets = [t for t in targets if t[1] not in duplicates]
+    # the merged image is shown wherever its duplicates were, keep the resolution the largest display needs
+    for xref, merged in duplicates.items():
+        if xref in dpis:
+            dpis[merged] = min(dpis.get(merged, dpis[xref]), dpis[xref])
+    lap('dedup')
+    threshold_method = threshold_method or ('otsu' if otsu else 'normal')
+    task = partial(_recompress_task, handle_types=handle_types, threshold_method=threshold_method, binary=binary,
+                   threshold=threshold, quality=quality, bilevel=bilevel, plan=plan, target_dpi=target_dpi,
+                   block_size=block_size)
+    replace_image = REPLACE_METHODS[replace]
+
+    with Pool(jobs) if jobs > 1 else nullcontext() as pool:
+        image_map = partial(pool.imap, chunksize=1) if pool else map
+        # bounded batches, only a few extracted images are held in memory
+        images = extract_images(doc, targets, dpis)
+        while batch := list(islice(images, max(jobs, 1) * 4)):
+            for page_idx, xref, image_new, note in image_map(task, batch):
+                if image_new is None:
+                    stats['skipped'] += 1
+                    logger.debug(f'skip image: xref[{xref}]: {note}')
+                    continue
+                if plan:
+                    logger.debug(f'image: xref[{xref}]: {note}')
+                replace_image(doc, page_idx, xref, image_new)
+                stats['replaced'] += 1
+    lap('recompress')
+
+    # merge duplicates into one object, the unreferenced copies are dropped on save
+    for referencer, name, xref in references:
+        if xref in duplicates:
+            set_xobject_reference(doc, referencer, name, duplicates[xref])
+    logger.info(report)
+
+    save_document(doc, out_file, save)
+    lap('save')
+    return stats
+
+
+def benchmark(path, variants: dict[str, dict], repeat=3, **options):
+    """time compress() on the pdf at path with every variant of options, prints seconds and output size"""
+    options = {'handle_types': ['RGB', 'L'], 'otsu': False, 'binary': False, 'page_filter': lambda x: True,
+               'threshold': 127, 'quality': 30, **options}
+    for name, variant in variants.items():
+        used = []
+        for _ in range(repeat):
+            out = io.BytesIO()
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                compress(f, out, **options, **variant)
+            used.append(time.perf_counter() - start)
+        print(f'{name:>8}: {min(used):.3f}s, {len(out.getvalue())} bytes')
+
+
+def benchmark_replace(path, repeat=3, **options):
+    benchmark(path, {replace: {'replace': replace} for replace in REPLACE_METHODS}, repeat, **options)
+
+
+def benchmark_bilevel(path, repeat=3, **options):
+    benchmark(path, {bilevel: {'bilevel': bilevel} for bilevel in BILEVEL_ENCODERS}, repeat, **options)
+
+
+def compress_file(in_path: Path, out_path: Path, pages, **options):
+    """batch worker, compress one file and return its summary record, errors are recorded instead of raised"""
+    record = {'input': str(in_path), 'output': str(out_path), 'input_size': in_path.stat().st_size}
+    start = time.perf_counter()
+    try:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        page_filter = get_page_config(pages) if pages else lambda x: True
+        record.update(compress(str(in_path), str(out_path), page_filter=page_filter, **options))
+        record['output_size'] = out_path.stat().st_size
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['wall_seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def _compress_file_task(work):
+    in_path, out_path, pages, options = work
+    return compress_file(in_path, out_path, pages, **options)
+
+
+def run_batch(input_dir: Path, output_dir: Path, pages, options, jobs=1, summary=None, force=False):
+    """
+    compress every pdf under input_dir into the same structure under output_dir, files in parallel,
+    one JSON line per file is appended to summary(default: output_dir/compress_summary.jsonl)
+    """
+    summary = Path(summary) if summary else output_dir.joinpath('compress_summary.jsonl')
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    works, up_to_date = [], 0
+    # earlier outputs are found again when output_dir is inside input_dir(not the other way round)
+    nested_output = output_dir != input_dir and output_dir.is_relative_to(input_dir)
+    for in_path in sorted(input_dir.rglob('*')):
+        if in_path.suffix.lower() != '.pdf' or not in_path.is_file():
+            continue
+        if nested_output and in_path.is_relative_to(output_dir):
+            continue
+        out_path = output_dir.joinpath(in_path.relative_to(input_dir))
+        # in place, the output is always newer than itself
+        if not force and out_path.is_file() and not out_path.samefile(in_path) \
+                and out_path.stat().st_mtime >= in_path.stat().st_mtime:
+            up_to_date += 1
+            continue
+        # parallel over files, one process per file
+        works.append((in_path, out_path, pages, {**options, 'jobs': 1}))
+
+    done, failed, input_size, output_size = 0, 0, 0, 0
+    start = time.perf_counter()
+    # multiprocessing go🚀
+    with Pool(jobs) as p, open(summary, 'a', encoding='utf-8') as summary_file:
+        for record in p.imap_unordered(_compress_file_task, works):
+            summary_file.write(json.dumps(record) + '\n')
+            summary_file.flush()
+            if 'error' in record:
+                failed += 1
+                logger.warning(f'FAIL: {record["input"]}, {record["error"]}')
+                continue
+            done += 1
+            input_size += record['input_size']
+            output_size += record['output_size']
+            logger.info(f'OK: {record["input"]}, {record["input_size"]} -> {record["output_size"]} bytes, '
+                        f'{record["wall_seconds"]}s')
 
-    # fix permission problem
-    out_file.write(doc.tobytes(garbage=4, clean=True, deflate=True))
+    print(f'{done} compressed, {up_to_date} up to date, {failed} failed, '
+          f'{input_size} -> {output_size} bytes in {time.perf_counter() - start:.1f}s, summary: {summary}')
+    return failed == 0
 
 
 def run(args):
     in_file = args.input
     out_file = args.output
     # flags = {(k_v := f.split('='))[0]: parse_flag(k_v[1]) for f in args.flags} if args.flags else {}
-    page_filter = get_page_config(args.pages) if args.pages else lambda x: True
     handle_type = args.handle_type if args.handle_type else ['RGB', 'L']
-    otsu = bool(args.otsu)
-    binary = bool(args.binary_image)
-    threshold = args.threshold
-    quality = args.quality
+    options = {
+        'handle_types': handle_type,
+        'otsu': bool(args.otsu),
+        'binary': bool(args.binary_image),
+        'threshold': args.threshold,
+        'quality': args.quality,
+        'jobs': args.jobs,
+        'replace': args.replace,
+        'save': args.save,
+        'bilevel': args.bilevel,
+        'plan': bool(args.plan),
+        'target_dpi': args.target_dpi,
+        'threshold_method': args.threshold_method,
+        'block_size': args.block_size,
+    }
+
+    if Path(in_file).is_dir():
+        return run_batch(Path(in_file), Path(out_file), args.pages, options, args.jobs, args.summary, args.force)
 
-    compress(in_file, out_file, handle_type, otsu, binary, page_filter, threshold, quality)
+    page_filter = get_page_config(args.pages) if args.pages else lambda x: True
+    stats = compress(in_file, out_file, page_filter=page_filter, **options)
+    logger.info(stats)
+    return True
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('input', type=argparse.FileType('rb'), help='input file')
-    parser.add_argument('output', type=argparse.FileType('wb'), help='output file')
+    parser.add_argument('input', type=str, help='input file, or directory of pdf files(batch mode)')
+    parser.add_argument('output', type=str, help='output file(can be the input file), or directory in batch mode')
     parser.add_argument('--pages', type=str, action='extend', nargs='*',
                         help='pages to process/skip, "{process, skip} 1 2-4" means to {process, skip} page [1, 2, 3, 4]')
     parser.add_argument('--handle_type', type=str, action='extend', nargs='*',
@@ -138,10 +652,37 @@ if __name__ == '__main__':
     parser.add_argument('-q', '--quality', type=int, default=30, help='jpeg image quality setting')
     parser.add_argument('-t', '--threshold', type=int, default=127, help='binary image threshold, when not using otsu')
     parser.add_argument('--otsu', action=argparse.BooleanOptionalAction, help='use otsu method to handle binary image')
+    parser.add_argument('--threshold_method', type=str, choices=['normal', 'otsu', 'adaptive', 'sauvola'],
+                        help='binary image method, adaptive and sauvola use local thresholds for unevenly lit scans')
+    parser.add_argument('--block_size', type=int, default=LOCAL_BLOCK_SIZE,
+                        help='neighbourhood size(odd, pixels) of adaptive and sauvola thresholds')
     # parser.add_argument('--flags', type=str, action='extend', nargs='*', help='flags for image convert')
     parser.add_argument('--binary_image', action=argparse.BooleanOptionalAction,
                         help='process all images to "black and white"')
+    parser.add_argument('--bilevel', type=str, default='flate', choices=list(BILEVEL_ENCODERS),
+                        help='encoder for "black and white" images, g4: CCITT Group 4, smaller and fast to decode')
+    parser.add_argument('--plan', action=argparse.BooleanOptionalAction,
+                        help='choose threshold/grey jpeg/colour jpeg/keep per image, replace only if smaller')
+    parser.add_argument('--target_dpi', type=int, default=None,
+                        help='downsample images shown at a higher resolution than this')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes for image re-encoding(batch mode: files), output is the same for any value')
+    parser.add_argument('--replace', type=str, default='stream', choices=list(REPLACE_METHODS),
+                        help='how images are written back, "insert" is the former insert/copy/delete approach')
+    parser.add_argument('--save', type=str, default='full', choices=list(SAVE_OPTIONS),
+                        help='full: smallest file; fast: skip deduplication and cleanup passes; '
+                             'incremental: append to the input(output must be the input), fastest, file does not shrink')
+
+    parser.add_argument('--summary', type=str, default=None,
+                        help='batch mode JSON lines summary file, default: output/compress_summary.jsonl')
+    parser.add_argument('-f', '--force', default=False, action=argparse.BooleanOptionalAction,
+                        help='batch mode: compress even if the output is newer than the input')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='-v: summaries and per file results, -vv: every page and image')
 
     args = parser.parse_args()
-    print(args)
+    if args.replace == 'insert' and args.bilevel != 'flate':
+        parser.error(f'--replace insert cannot write --bilevel {args.bilevel} images, use --replace stream')
+    logging.basicConfig(format='%(message)s', level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+    logger.info(args)
     run(args)
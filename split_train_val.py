@@ -1,43 +1,164 @@
-r"""This script takes a label_path image_path pair, split them randomly.
+r"""This script takes a label_path image_path pair, split them.
+
+By default a sample goes to val if the (seeded) hash of its name falls in the val share,
+so the split is the same on every run, and samples keep their split when the dataset grows.
+With --group the hash of the clip decides instead, so all frames of a clip share a split, and keep it.
 
 EXAMPLE:
     python split_train_val.py -i path_to_labels path_to_images
     --image_ext .jpg --label_ext .txt
     --output path_to_output
+
+    Keep the class balance in both sets, and frames of one clip(Cxx_ prefix) in one set:
+
+    python split_train_val.py -i path_to_labels path_to_images --image_ext .jpg --output path_to_output
+    --stratify --group
 """
 
 import argparse
+import hashlib
+import os
 import random
+import re
+from collections import Counter, defaultdict
+from itertools import repeat
+from multiprocessing import Pool
 from pathlib import Path
 
+WRITE_CHUNK = 1 << 16  # lines joined into one write
+HASH_BUCKETS = 1000
+GROUP_PATTERN = re.compile(r'(C\d+)_')  # clip prefix written by make_dataset_from_labels_and_video.py
+SPLIT_METHODS = ('hash', 'random')
+
+
+def iter_files(path: Path, ext):
+    """(stem, name) of files with extension ext in path, one directory pass"""
+    ext = ext.lower()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            stem, suffix = os.path.splitext(entry.name)
+            if suffix.lower() == ext and entry.is_file():
+                yield stem, entry.name
+
 
 def get_paired(image_path: Path, image_ext, label_path: Path, label_ext):
-    image_ext, label_ext = image_ext.lower(), label_ext.lower()
-    label_files = list(filter(lambda f: f.suffix.lower() == label_ext, label_path.iterdir()))
-    image_files = list(filter(lambda f: f.suffix.lower() == image_ext, image_path.iterdir()))
-
-    pairs = []
-    for label in label_files:
-        image = image_path.joinpath(label.with_suffix(image_ext).name)
-        if image.is_file():
-            try:
-                image_files.remove(image)
-                pairs.append((label, image))
-            except ValueError:
-                print(f'{label} has no matched image')
+    """sorted stems of labels with a matched image, and the stem -> image name, stem -> label name lookups"""
+    images = dict(iter_files(image_path, image_ext))
+    labels = dict(iter_files(label_path, label_ext))
+    paired, unmatched = [], []
+    for stem in labels:
+        (paired if stem in images else unmatched).append(stem)
+
+    if unmatched:
+        print(f'{len(unmatched)} labels have no matched image, e.g. {unmatched[:5]}')
+    if len(images) > len(paired):
+        print(f'{len(images) - len(paired)} images have no matched label')
+    # directory order differs between file systems, a seeded split must not depend on it
+    paired.sort()
+    return paired, images, labels
+
+
+def split_indices(size, test_size, seed=None) -> bytearray:
+    """test mask of `size` samples, `test_size` of them randomly set to 1"""
+    mask = bytearray(size)
+    # use sample instead choice for non-repeated results
+    for i in random.Random(seed).sample(range(size), k=test_size):
+        mask[i] = 1
+    return mask
 
-    if image_files:
-        print(f'{image_files} have not matched image')
-    return pairs
 
+def stable_hash(key: str, seed=0) -> int:
+    """seeded 64 bit hash, the same on every run and machine(unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(f'{seed}:{key}'.encode(), digest_size=8).digest(), 'little')
 
-def write_config(train: list[Path], test: list[Path], output_path: Path):
+
+def hash_split(paired, test_proportion, seed=0) -> bytearray:
+    """test mask, test if the hash bucket of the stem is in the test share, a sample never changes its split"""
+    threshold = round(HASH_BUCKETS * test_proportion)
+    return bytearray(stable_hash(stem, seed) % HASH_BUCKETS < threshold for stem in paired)
+
+
+def read_classes(label_file) -> tuple[int, ...]:
+    """class ids in a yolo label file, malformed lines are skipped"""
+    classes = set()
+    with open(label_file) as f:
+        for line in f:
+            try:
+                c = int(line.split(maxsplit=1)[0])
+            except (IndexError, ValueError):
+                continue
+            if c >= 0:
+                classes.add(c)
+    return tuple(classes)
+
+
+def get_strata(label_path: Path, paired, labels, jobs=None) -> list[int]:
+    """stratum of every sample: the rarest class in it, -1 for no box. labels are read in parallel"""
+    # actual names, the extension is matched case-insensitively
+    label_files = [os.path.join(label_path, labels[stem]) for stem in paired]
+    # multiprocessing go🚀
+    with Pool(jobs) as p:
+        classes = p.map(read_classes, label_files, chunksize=1024)
+    frequency = Counter(c for sample_classes in classes for c in sample_classes)
+    return [min(sample_classes, key=lambda c: (frequency[c], c)) if sample_classes else -1
+            for sample_classes in classes]
+
+
+def get_group(stem) -> str:
+    """clip of a sample, the stem itself if it has no clip prefix"""
+    m = GROUP_PATTERN.match(stem)
+    return m.group(1) if m else stem
+
+
+def balanced_split(paired, test_proportion, seed=0, strata=None, group=False) -> bytearray:
+    """
+    test mask, units(samples, or clips with group) are taken in hash order, each unit goes to test
+    if that brings the test shares of all strata, together, closer to test_proportion.
+    the result is the same on every run, but not growth-stable: a new unit can move later ones.
+    falls back to the hash rule of the units if train or test would be empty.
+    """
+    keys = [get_group(stem) for stem in paired] if group else paired
+    unit_strata = defaultdict(Counter)
+    for key, stratum in zip(keys, strata or repeat(0)):
+        unit_strata[key][stratum] += 1
+    targets = Counter()
+    for counts in unit_strata.values():
+        targets.update(counts)
+    sizes = dict(targets)
+    for stratum in targets:
+        targets[stratum] *= test_proportion
+
+    test_keys, taken = set(), Counter()
+    for key in sorted(unit_strata, key=lambda k: (stable_hash(k, seed), k)):
+        counts = unit_strata[key]
+        # change of the summed squared distances to the targets, relative to the stratum sizes
+        change = sum(((taken[s] + n - targets[s]) ** 2 - (taken[s] - targets[s]) ** 2) / sizes[s] ** 2
+                     for s, n in counts.items())
+        if change < 0:
+            test_keys.add(key)
+            taken.update(counts)
+
+    if not test_keys or len(test_keys) == len(unit_strata):
+        threshold = round(HASH_BUCKETS * test_proportion)
+        test_keys = {key for key in unit_strata if stable_hash(key, seed) % HASH_BUCKETS < threshold}
+    return bytearray(key in test_keys for key in keys)
+
+
+def write_config(paired, images, test_mask, image_path: Path, output_path: Path):
+    """stream image paths(relative to output_path) to train.txt and val.txt in chunks"""
+    prefix = os.path.relpath(image_path, output_path)
     train_path, test_path = output_path.joinpath('train.txt'), output_path.joinpath('val.txt')
-    with open(train_path, 'w+') as train_file, open(test_path, 'w+') as test_file:
-        for t in train:
-            train_file.write(f'{t.relative_to(output_path)}\n')
-        for t in test:
-            test_file.write(f'{t.relative_to(output_path)}\n')
+    with open(train_path, 'w', buffering=1 << 20) as train_file, open(test_path, 'w', buffering=1 << 20) as test_file:
+        files, chunks = (train_file, test_file), ([], [])
+        for stem, is_test in zip(paired, test_mask):
+            chunk = chunks[is_test]
+            chunk.append(images[stem] if prefix == '.' else os.path.join(prefix, images[stem]))
+            if len(chunk) >= WRITE_CHUNK:
+                files[is_test].write('\n'.join(chunk) + '\n')
+                chunk.clear()
+        for file, chunk in zip(files, chunks):
+            if chunk:
+                file.write('\n'.join(chunk) + '\n')
 
 
 if __name__ == '__main__':
@@ -47,6 +168,15 @@ if __name__ == '__main__':
     parser.add_argument('--image_ext', type=str, help='image file extension name')
     parser.add_argument('--training_proportion', type=float, default='0.8', help='training proportion')
     parser.add_argument('--output', type=str, help='output path')
+    parser.add_argument('--split', type=str, default='hash', choices=SPLIT_METHODS,
+                        help='hash: by name hash, the same on every run, random: random sample')
+    parser.add_argument('--seed', type=int, default=None, help='hash salt(default 0) or random seed(default none)')
+    parser.add_argument('--stratify', default=False, action=argparse.BooleanOptionalAction,
+                        help='same class proportions in train and val, reads every label. '
+                             'samples may change their split when the dataset grows')
+    parser.add_argument('--group', default=False, action=argparse.BooleanOptionalAction,
+                        help='frames of a clip(Cxx_ prefix) all go to train or all to val')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='label reading processes(default: cpu count)')
     args = parser.parse_args()
 
     label_path = Path(args.i[0])
@@ -57,20 +187,27 @@ if __name__ == '__main__':
     image_ext = args.image_ext
     train_proportion = args.training_proportion
 
-    paired = get_paired(image_path, image_ext, label_path, label_ext)
+    paired, images, labels = get_paired(image_path, image_ext, label_path, label_ext)
 
     paired_size = len(paired)
-    train_size = round(paired_size * train_proportion)
-    test_size = paired_size - train_size
+    test_proportion = 1 - train_proportion
+    if args.stratify:
+        # hash ordered, balanced over all strata
+        strata = get_strata(label_path, paired, labels, args.jobs)
+        test_mask = balanced_split(paired, test_proportion, args.seed or 0, strata, args.group)
+    elif args.group:
+        test_mask = hash_split([get_group(stem) for stem in paired], test_proportion, args.seed or 0)
+    elif args.split == 'hash':
+        test_mask = hash_split(paired, test_proportion, args.seed or 0)
+    else:
+        test_mask = split_indices(paired_size, round(paired_size * test_proportion), args.seed)
+
+    test_size = sum(test_mask)
+    train_size = paired_size - test_size
     if train_size < 1 or test_size < 1:
         raise ValueError(f'sample too small')
 
-    # use sample instead choice for non-repeated results
-    selected_test = random.sample(paired, k=test_size)
-
-    train = [t[1] for t in (list(set(paired) - set(selected_test)))]
-    test = [t[1] for t in selected_test]
-
-    write_config(train, test, output_path)
+    write_config(paired, images, test_mask, image_path, output_path)
 
+    print(f'{train_size} train, {test_size} val({test_size / paired_size:.1%})')
     print('DONE!')
@@ -12,6 +12,32 @@ for path in root.rglob('*.ass'):
     print(path)
     AssSubtitle(path).scaled('00:00:00.40', '00:00:00', '00:22:02.20', '00:22:00').save(keep_name=False)
 
+# multiple anchor points(piecewise linear)
+ass_sub.scaled_piecewise(['00:00:00', '00:10:00', '00:22:00'], ['00:00:01', '00:10:30', '00:22:30']).save()
+
+# cues shown at/around a time(binary search, also works on shifted/scaled copies)
+ass_sub.at('00:01:03.00'), ass_sub.overlapping(60, 120), ass_sub.within(60, 120), ass_sub.overlapped()
+
+# srt/vtt, or pick the type by suffix
+SrtSubtitle(srt_file).scaled(...).save()
+open_subtitle(sub_file) >> 1.5
+
+# huge files, streamed line by line
+retime_subtitle(sub_file, TimeMapping.shifted(-2))
+
+# command line, retime a whole season(all supported types) in parallel, up to date outputs are skipped
+python subtitle_shifter.py path_to_season --shift -1.5
+python subtitle_shifter.py path_to_season --scale 00:00:00.40 00:00:00 00:22:02.20 00:22:00 --jobs 4
+# or sync each subtitle to the speech of the video with the same name prefix
+python subtitle_shifter.py path_to_season --auto-sync
+
+# auto sync, in code
+mapping, score = estimate_sync(ass_sub, video_file)
+ass_sub.mapped(mapping).save()
+
+# time code codec round trip check and micro-benchmark
+python -c "import subtitle_shifter; subtitle_shifter.benchmark_time_codec()"
+
 """
 
 from datetime import timedelta
@@ -52,7 +78,332 @@ def get_linear_scaler(p1, p1_new, p2, p2_new):
     return scaler
 
 
-from copy import deepcopy
+def to_seconds(t) -> float:
+    """accepts time string, timedelta or number of seconds"""
+    if isinstance(t, str):
+        return string_to_seconds(t)
+    if isinstance(t, timedelta):
+        return t.total_seconds()
+    return float(t)
+
+
+import numpy as np
+
+
+import re
+
+
+class TimeCodec:
+    """
+    Fixed width time code <-> integer ticks, the template decides the layout and precision,
+    e.g. '0:00:00.00' is ASS time in centiseconds, '00:00:00,000' is SRT time in milliseconds.
+    Batches are converted with numpy byte arithmetic, rows not fitting the template
+    (more hours than the width allows, short fractions, missing hours, whitespace) fall back to scalar code.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.width = len(template)
+        self.groups = [m.span() for m in re.finditer('0+', template)]
+        if len(self.groups) != 4:
+            raise ValueError(f'template should be hours:minutes:seconds<sep>fraction: {template}')
+        self.hour_digits = self.groups[0][1] - self.groups[0][0]
+        self.fraction_digits = self.groups[3][1] - self.groups[3][0]
+        self.fraction_sep = template[self.groups[3][0] - 1]
+        self.ticks = 10 ** self.fraction_digits
+        self.weights = [3600 * self.ticks, 60 * self.ticks, self.ticks, 1]
+        self._separators = [(i, ord(c)) for i, c in enumerate(template) if c != '0']
+        self._template = np.frombuffer(template.encode('ascii'), dtype=np.uint8)
+
+    def parse_one(self, time_string: str) -> int:
+        *hours_minutes, seconds = time_string.strip().split(':')
+        minutes = int(hours_minutes[-1]) if hours_minutes else 0
+        hours = int(hours_minutes[-2]) if len(hours_minutes) > 1 else 0
+        return (hours * 60 + minutes) * 60 * self.ticks + round(float(seconds.replace(',', '.')) * self.ticks)
+
+    def format_one(self, ticks: int) -> str:
+        seconds, fraction = divmod(max(int(ticks), 0), self.ticks)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return (f'{hours:0{self.hour_digits}}:{minutes:02}:{seconds:02}'
+                f'{self.fraction_sep}{fraction:0{self.fraction_digits}}')
+
+    def parse(self, time_strings) -> np.ndarray:
+        """parse time codes to an int64 array of ticks"""
+        time_strings = list(time_strings)
+        if not time_strings:
+            return np.zeros(0, dtype=np.int64)
+        try:
+            raw = np.array(time_strings, dtype=f'S{self.width}')
+        except UnicodeEncodeError:
+            return np.array([self.parse_one(t) for t in time_strings], dtype=np.int64)
+
+        chars = raw.view(np.uint8).reshape(-1, self.width)
+        digits = chars.astype(np.int64) - ord('0')
+        valid = np.fromiter(map(len, time_strings), dtype=np.int64, count=len(time_strings)) == self.width
+        result = np.zeros(len(time_strings), dtype=np.int64)
+        for (start, end), weight in zip(self.groups, self.weights):
+            group = digits[:, start:end]
+            valid &= np.all((group >= 0) & (group <= 9), axis=1)
+            result += group @ (10 ** np.arange(end - start - 1, -1, -1)) * weight
+        for column, char in self._separators:
+            valid &= chars[:, column] == char
+
+        for i in np.flatnonzero(~valid).tolist():
+            result[i] = self.parse_one(time_strings[i])
+        return result
+
+    def format(self, ticks) -> list[str]:
+        """format ticks(any int array-like) to time codes, negative times are clamped to 0"""
+        ticks = np.maximum(np.asarray(ticks, dtype=np.int64).ravel(), 0)
+        chars = np.tile(self._template, (len(ticks), 1))
+        rest = ticks
+        for (start, end), weight in zip(self.groups, self.weights):
+            value, rest = np.divmod(rest, weight)
+            for column in range(end - 1, start - 1, -1):
+                value, digit = np.divmod(value, 10)
+                chars[:, column] += digit.astype(np.uint8)
+        result = chars.view(f'S{self.width}').ravel().astype(f'U{self.width}').tolist()
+
+        # hours that do not fit the width
+        for i in np.flatnonzero(ticks >= 10 ** self.hour_digits * self.weights[0]).tolist():
+            result[i] = self.format_one(ticks[i])
+        return result
+
+    def parse_seconds(self, time_strings) -> np.ndarray:
+        return self.parse(time_strings) / self.ticks
+
+    def to_ticks(self, seconds) -> np.ndarray:
+        return np.rint(np.asarray(seconds, dtype=np.float64) * self.ticks).astype(np.int64)
+
+    def format_seconds(self, seconds) -> list[str]:
+        return self.format(self.to_ticks(seconds))
+
+    def format_second(self, seconds: float) -> str:
+        return self.format_one(round(seconds * self.ticks))
+
+
+ASS_TIME = TimeCodec('0:00:00.00')
+SRT_TIME = TimeCodec('00:00:00,000')
+VTT_TIME = TimeCodec('00:00:00.000')
+
+
+def parse_centiseconds(time_strings) -> np.ndarray:
+    """parse ASS time codes to an int64 array of centiseconds"""
+    return ASS_TIME.parse(time_strings)
+
+
+def format_centiseconds(centiseconds) -> list[str]:
+    """format centiseconds(any int array-like) to ASS time codes, negative times are clamped to 0"""
+    return ASS_TIME.format(centiseconds)
+
+
+def seconds_to_centiseconds(seconds) -> np.ndarray:
+    return ASS_TIME.to_ticks(seconds)
+
+
+def benchmark_time_codec(n=200_000, repeat=3):
+    """round trip check, then compare the batch codec with string_to_seconds/seconds_to_string"""
+    from timeit import timeit
+
+    rng = np.random.default_rng(0)
+    cs = rng.integers(0, 10 * 360000, n)
+    strings = format_centiseconds(cs)
+    seconds = (cs / 100).tolist()
+
+    assert np.array_equal(parse_centiseconds(strings), cs), 'parse(format(cs)) != cs'
+    assert format_centiseconds(parse_centiseconds(strings)) == strings, 'format(parse(s)) != s'
+    assert strings == [seconds_to_string(t) for t in seconds], 'format differs from seconds_to_string'
+    assert np.allclose([string_to_seconds(t) for t in strings], cs / 100), 'parse differs from string_to_seconds'
+    assert parse_centiseconds(['12:34:56.78', '1:02:03.4', ' 0:00:01.00'] + strings[:1])[:3].tolist() == \
+           [4529678, 372340, 100], 'slow path'
+    ms = cs * 10 + rng.integers(0, 10, n)
+    for codec in (SRT_TIME, VTT_TIME):
+        assert np.array_equal(codec.parse(codec.format(ms)), ms), f'{codec.template} round trip'
+    assert VTT_TIME.parse(['01:02.345', '100:00:00.000']).tolist() == [62345, 360000000], 'vtt slow path'
+
+    timings = {
+        'string_to_seconds': timeit(lambda: [string_to_seconds(t) for t in strings], number=repeat),
+        'parse_centiseconds': timeit(lambda: parse_centiseconds(strings), number=repeat),
+        'seconds_to_string': timeit(lambda: [seconds_to_string(t) for t in seconds], number=repeat),
+        'format_centiseconds': timeit(lambda: format_centiseconds(seconds_to_centiseconds(seconds)), number=repeat),
+    }
+    for name, t in timings.items():
+        print(f'{name:>20}: {t / repeat * 1000:8.1f}ms / {n} time codes')
+    return timings
+
+
+class TimeMapping:
+    """
+    Increasing piecewise linear time mapping through (points[i], new_points[i]),
+    extrapolated with the first/last segment outside the points.
+    Immutable, chained transforms compose into one mapping so they cost a single pass over the cues.
+    """
+
+    def __init__(self, points=(0., 1.), new_points=(0., 1.)):
+        points = np.array(points, dtype=np.float64)
+        new_points = np.array(new_points, dtype=np.float64)
+        if points.shape != new_points.shape or points.ndim != 1 or len(points) < 2:
+            raise ValueError('at least 2 pairs of points are required')
+        if np.any(np.diff(points) <= 0) or np.any(np.diff(new_points) <= 0):
+            raise ValueError('points must be strictly increasing')
+        self.points = points
+        self.new_points = new_points
+        self.slopes = np.diff(new_points) / np.diff(points)
+
+    @classmethod
+    def shifted(cls, offset: float):
+        return cls((0., 1.), (offset, 1. + offset))
+
+    @classmethod
+    def linear(cls, t1, t1_new, t2, t2_new):
+        if t1 > t2:
+            t1, t1_new, t2, t2_new = t2, t2_new, t1, t1_new
+        return cls((t1, t2), (t1_new, t2_new))
+
+    @property
+    def is_identity(self):
+        return bool(np.all(self.points == self.new_points))
+
+    def __call__(self, t):
+        a = np.asarray(t, dtype=np.float64)
+        idx = np.clip(np.searchsorted(self.points, a, side='right') - 1, 0, len(self.slopes) - 1)
+        result = self.new_points[idx] + self.slopes[idx] * (a - self.points[idx])
+        return float(result) if result.ndim == 0 else result
+
+    def inverse(self):
+        return TimeMapping(self.new_points, self.points)
+
+    def then(self, other: 'TimeMapping'):
+        """mapping equivalent to applying self first, then other"""
+        points = np.union1d(self.points, self.inverse()(other.points))
+        # merge breakpoints that only differ by rounding error
+        points = points[np.concatenate(([True], np.diff(points) > 1e-9))]
+        new_points = other(self(points))
+        # drop breakpoints where the slope does not change
+        slopes = np.diff(new_points) / np.diff(points)
+        keep = np.concatenate(([True], ~np.isclose(slopes[1:], slopes[:-1]), [True]))
+        return TimeMapping(points[keep], new_points[keep])
+
+    def __repr__(self):
+        return '<TimeMapping {}>'.format(list(zip(self.points.tolist(), self.new_points.tolist())))
+
+
+class CueIndex:
+    """
+    Cues sorted by start time plus the running maximum of end times, every query is
+    a binary search for the candidate range and a vectorized filter over it.
+    A cue is shown during [start, end), query results are cue indices in timeline order.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray):
+        self.order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends.copy()
+
+    def apply(self, mapping: TimeMapping):
+        """an increasing mapping keeps the order(and the running maximum), only values move"""
+        self.starts = mapping(self.starts)
+        self.ends = mapping(self.ends)
+        self.max_ends = mapping(self.max_ends)
+        return self
+
+    def _select(self, lo, hi, mask):
+        return np.sort(self.order[lo:hi][mask])
+
+    def at(self, t: float) -> np.ndarray:
+        """cues shown at time t"""
+        lo = np.searchsorted(self.max_ends, t, side='right')
+        hi = np.searchsorted(self.starts, t, side='right')
+        return self._select(lo, hi, self.ends[lo:hi] > t)
+
+    def overlapping(self, a: float, b: float) -> np.ndarray:
+        """cues shown at any time in [a, b)"""
+        lo = np.searchsorted(self.max_ends, a, side='right')
+        hi = np.searchsorted(self.starts, b, side='left')
+        return self._select(lo, hi, self.ends[lo:hi] > a)
+
+    def within(self, a: float, b: float) -> np.ndarray:
+        """cues entirely inside [a, b]"""
+        lo = np.searchsorted(self.starts, a, side='left')
+        hi = np.searchsorted(self.starts, b, side='right')
+        return self._select(lo, hi, self.ends[lo:hi] <= b)
+
+    def overlapped(self) -> np.ndarray:
+        """cues starting before an earlier cue has ended"""
+        return self._select(1, None, self.starts[1:] < self.max_ends[:-1])
+
+
+class Timeline:
+    """
+    Cue start/end times(seconds) kept in contiguous float64 arrays,
+    every transform is a single vectorized operation over the whole timeline.
+    The CueIndex is built on first use and kept in sync by the transforms,
+    modify starts/ends directly and it needs to be rebuilt(call invalidate_index).
+    """
+
+    def __init__(self, starts=(), ends=()):
+        self.starts = np.array(starts, dtype=np.float64)
+        self.ends = np.array(ends, dtype=np.float64)
+        if self.starts.shape != self.ends.shape or self.starts.ndim != 1:
+            raise ValueError('starts and ends must be 1-d arrays of the same length')
+        self._index = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def index(self) -> CueIndex:
+        if self._index is None:
+            self._index = CueIndex(self.starts, self.ends)
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
+
+    def copy(self):
+        return Timeline(self.starts, self.ends)
+
+    def shift(self, offset: float):
+        """delay all cues by offset seconds(negative to advance), in place"""
+        self.starts += offset
+        self.ends += offset
+        if self._index is not None:
+            self._index.apply(TimeMapping.shifted(offset))
+        return self
+
+    def scale(self, t1, t1_new, t2, t2_new):
+        """linear scaling that maps t1 to t1_new and t2 to t2_new, in place"""
+        if t1 == t2:
+            raise ValueError('scale points must be different')
+        scale = (t2_new - t1_new) / (t2 - t1)
+        for a in (self.starts, self.ends):
+            a -= t1
+            a *= scale
+            a += t1_new
+        if self._index is not None:
+            # reversing/collapsing the order needs a rebuild
+            self._index = self._index.apply(TimeMapping.linear(t1, t1_new, t2, t2_new)) if scale > 0 else None
+        return self
+
+    def piecewise(self, points, new_points):
+        """piecewise linear mapping through (points[i], new_points[i]), in place"""
+        return self.apply(TimeMapping(points, new_points))
+
+    def apply(self, mapping: TimeMapping):
+        """apply mapping in place"""
+        self.starts[:] = mapping(self.starts)
+        self.ends[:] = mapping(self.ends)
+        if self._index is not None:
+            self._index.apply(mapping)
+        return self
+
+    def mapped(self, mapping: TimeMapping):
+        return Timeline(mapping(self.starts), mapping(self.ends))
+
+
+from copy import copy
 from typing import Any, Callable, Optional
 from attr import dataclass
 
@@ -73,66 +424,118 @@ class SubtitleElement:
         return super().__str__() if not self.parser else self.content
 
 
-class Subtitle(list[SubtitleElement]):
+class Subtitle:
+    """
+    Subtitle cues, times are held by a Timeline, parsers(one per cue) in a list of the same order.
+    Indexing and iterating produce SubtitleElement snapshots.
+
+    Transforms are copy-on-write: <<, >>, scaled() etc. return a subtitle sharing timeline, parsers and text
+    with the original, only the composed TimeMapping differs. The mapping is applied when times are read.
+    """
+
     def __init__(self, name=None, elements=None):
-        super().__init__()
-        if elements:
-            self.extend(elements)
+        elements = list(elements) if elements else []
+        self.timeline = Timeline([e.start for e in elements], [e.end for e in elements])
+        self.parsers = [e.parser for e in elements]
+        self.mapping = TimeMapping()
         self.name = name
 
-    def __ilshift__(self, offset: timedelta):
-        for e in self:
-            e.start -= offset
-            e.end -= offset
+    def times(self):
+        """start and end time arrays, with the mapping applied"""
+        if self.mapping.is_identity:
+            return self.timeline.starts, self.timeline.ends
+        return self.mapping(self.timeline.starts), self.mapping(self.timeline.ends)
+
+    def __len__(self):
+        return len(self.timeline)
+
+    # time range queries, times are after the mapping, the index of the shared timeline is
+    # queried with inverse mapped times so it never needs rebuilding for transformed copies
+    def at(self, t) -> np.ndarray:
+        """indices of cues shown at time t"""
+        return self.timeline.index.at(self.mapping.inverse()(to_seconds(t)))
+
+    def overlapping(self, a, b) -> np.ndarray:
+        """indices of cues shown at any time in [a, b)"""
+        inverse = self.mapping.inverse()
+        return self.timeline.index.overlapping(inverse(to_seconds(a)), inverse(to_seconds(b)))
+
+    def within(self, a, b) -> np.ndarray:
+        """indices of cues entirely inside [a, b]"""
+        inverse = self.mapping.inverse()
+        return self.timeline.index.within(inverse(to_seconds(a)), inverse(to_seconds(b)))
+
+    def overlapped(self) -> np.ndarray:
+        """indices of cues starting before an earlier cue has ended"""
+        return self.timeline.index.overlapped()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Subtitle(self.name, [self[i] for i in range(*index.indices(len(self)))])
+        return SubtitleElement(self.mapping(self.timeline.starts[index]), self.mapping(self.timeline.ends[index]),
+                               self.parsers[index])
+
+    def __iter__(self):
+        starts, ends = self.times()
+        return map(SubtitleElement, starts.tolist(), ends.tolist(), self.parsers)
+
+    def mapped(self, mapping: TimeMapping):
+        """new subtitle sharing all data with this one, with mapping applied after the current one"""
+        cp = copy(self)
+        cp.mapping = self.mapping.then(mapping)
+        return cp
+
+    def __ilshift__(self, offset: float | timedelta):
+        self.mapping = self.mapping.then(TimeMapping.shifted(-to_seconds(offset)))
         return self
 
-    def __irshift__(self, offset: timedelta):
-        return self.__ilshift__(-offset)
+    def __irshift__(self, offset: float | timedelta):
+        self.mapping = self.mapping.then(TimeMapping.shifted(to_seconds(offset)))
+        return self
 
-    def __lshift__(self, offset: timedelta):
-        cp = deepcopy(self)
-        cp <<= offset
-        return cp
+    def __lshift__(self, offset: float | timedelta):
+        return self.mapped(TimeMapping.shifted(-to_seconds(offset)))
 
-    def __rshift__(self, offset: timedelta):
-        return self << -offset
+    def __rshift__(self, offset: float | timedelta):
+        return self.mapped(TimeMapping.shifted(to_seconds(offset)))
 
     def scaled(self, t1, t1_new, t2, t2_new):
         type_set = set(map(type, [t1, t1_new, t2, t2_new]))
         assert len(type_set) == 1
 
-        if str in type_set:
-            t1, t1_new, t2, t2_new = map(
-                lambda t: string_to_seconds(t),
-                (t1, t1_new, t2, t2_new)
-            )
-        elif timedelta in type_set:
-            t1, t1_new, t2, t2_new = map(
-                lambda t: timedelta.total_seconds(t),
-                (t1, t1_new, t2, t2_new)
-            )
-
-        assert isinstance(t1, float)
-
-        cp = deepcopy(self)
-        scaler = get_linear_scaler(t1, t1_new, t2, t2_new)
-        for e in cp:
-            e.start = scaler(e.start)
-            e.end = scaler(e.end)
-        return cp
+        return self.mapped(TimeMapping.linear(*map(to_seconds, (t1, t1_new, t2, t2_new))))
+
+    def scaled_piecewise(self, points, new_points):
+        """like scaled, but with multiple anchor points, e.g. to fix cuts/ads at several positions"""
+        return self.mapped(TimeMapping(list(map(to_seconds, points)), list(map(to_seconds, new_points))))
 
     def __repr__(self):
-        return '<Subtitle \"{}\": {}>'.format(self.name, super().__repr__())
+        return '<Subtitle \"{}\": {}>'.format(self.name, list(self))
 
     def __str__(self):
         return '\"{}\":\n'.format(self.name) + ''.join(map(str, self))
 
 
-from itertools import chain
+from itertools import islice
 from pathlib import Path
 
 
-class AssSubtitle(Subtitle):
+def get_output_path(path: Path, name=None, keep_name=False):
+    if keep_name:
+        name = path.stem
+    if name is None:
+        name = path.stem + '_shifted'
+    return path.with_stem(name)
+
+
+class TextSubtitle(Subtitle):
+    """
+    Line based subtitle file. Lines matching cue_pattern(named groups 'start' and 'end')
+    are cues, every other line is kept as is. Subclasses set cue_pattern and codec.
+    """
+    cue_pattern: re.Pattern
+    codec: TimeCodec
+
     def __init__(self, path, encoding='utf-8', name=None):
         path = Path(path)
         assert path.is_file()
@@ -144,36 +547,302 @@ class AssSubtitle(Subtitle):
         with open(path, encoding=encoding) as f:
             self.lines = f.readlines()
 
+        # cue lines are stored as their index in timeline/parsers
         self.contents = []
-        elements = []
+        starts, ends, parsers = [], [], []
+        match = self.cue_pattern.match
         for line in self.lines:
-            if line.startswith('Dialogue:'):
-                parser, start, end = self.get_ass_dialogue_parser(line)
-                ele = SubtitleElement(string_to_seconds(start), string_to_seconds(end), parser)
-                elements.append(ele)
-                self.contents.append(ele)
+            if m := match(line):
+                self.contents.append(len(parsers))
+                starts.append(m['start'])
+                ends.append(m['end'])
+                parsers.append(self.get_cue_parser(line, m))
             else:
                 self.contents.append(line)
 
         self.encoding = encoding
-        super().__init__(name=name, elements=elements)
+        super().__init__(name=name)
+        self.timeline = Timeline(self.codec.parse_seconds(starts), self.codec.parse_seconds(ends))
+        self.parsers = parsers
 
-    @staticmethod
-    def get_ass_dialogue_parser(line):
-        segments = line.split(sep=',')
+    @classmethod
+    def get_cue_parser(cls, line, m: re.Match):
+        # keep the original line(shared with self.lines) and the positions of the time fields
+        (s0, s1), (e0, e1) = m.span('start'), m.span('end')
 
-        def parser(start, end):
-            return ','.join(chain((segments[0], seconds_to_string(start), seconds_to_string(end)), segments[3:]))
+        # formatter=str takes times already formatted in batch
+        def parser(start, end, formatter=cls.codec.format_second):
+            return ''.join((line[:s0], formatter(start), line[s1:e0], formatter(end), line[e1:]))
 
-        return parser, segments[1], segments[2]
+        return parser
+
+    def iter_lines(self):
+        starts, ends = map(self.codec.format_seconds, self.times())
+        parsers = self.parsers
+        return ((parsers[c](starts[c], ends[c], str) if isinstance(c, int) else c) for c in self.contents)
 
     def parse(self):
-        return ''.join(((c.content if isinstance(c, SubtitleElement) else c) for c in self.contents))
+        return ''.join(self.iter_lines())
 
     def save(self, name=None, keep_name=False):
-        if keep_name:
-            name = self.path.stem
-        if name is None:
-            name = self.path.stem + '_shifted'
-        with open(self.path.with_stem(name), 'w', encoding=self.encoding) as f:
-            f.write(self.parse())
+        with open(get_output_path(self.path, name, keep_name), 'w', encoding=self.encoding) as f:
+            f.writelines(self.iter_lines())
+
+    @classmethod
+    def retime_lines(cls, lines: list[str], mapping: TimeMapping):
+        """retime cue lines in place, all times in lines are mapped with one vectorized call"""
+        match = cls.cue_pattern.match
+        cues = [(i, m) for i, m in enumerate(map(match, lines)) if m]
+        if not cues:
+            return lines
+
+        starts = cls.codec.format_seconds(mapping(cls.codec.parse_seconds(m['start'] for _, m in cues)))
+        ends = cls.codec.format_seconds(mapping(cls.codec.parse_seconds(m['end'] for _, m in cues)))
+        for (i, m), start, end in zip(cues, starts, ends):
+            line = lines[i]
+            (s0, s1), (e0, e1) = m.span('start'), m.span('end')
+            lines[i] = ''.join((line[:s0], start, line[s1:e0], end, line[e1:]))
+        return lines
+
+    @classmethod
+    def retime(cls, path, mapping: TimeMapping, name=None, keep_name=False, encoding='utf-8', chunk_lines=4096):
+        """
+        Streaming equivalent of cls(path).mapped(mapping).save(name, keep_name).
+        Only chunk_lines lines are held in memory at a time, regardless of the file size.
+        Output goes to a temporary file first, so keep_name(overwrite input) is safe.
+        """
+        path = Path(path)
+        assert path.is_file()
+        output = get_output_path(path, name, keep_name)
+        temp = output.with_name(output.name + '.tmp')
+
+        with open(path, encoding=encoding) as fin, open(temp, 'w', encoding=encoding) as fout:
+            for chunk in iter(lambda: list(islice(fin, chunk_lines)), []):
+                fout.writelines(cls.retime_lines(chunk, mapping))
+        return temp.replace(output)
+
+
+class AssSubtitle(TextSubtitle):
+    cue_pattern = re.compile(r'Dialogue:[^,]*,(?P<start>[^,]*),(?P<end>[^,]*),')
+    codec = ASS_TIME
+
+
+class SrtSubtitle(TextSubtitle):
+    cue_pattern = re.compile(r'\s*(?P<start>\d+:\d+:\d+[,.]\d+)\s*-->\s*(?P<end>\d+:\d+:\d+[,.]\d+)')
+    codec = SRT_TIME
+
+
+class VttSubtitle(TextSubtitle):
+    cue_pattern = re.compile(r'\s*(?P<start>(?:\d+:)?\d+:\d+\.\d+)\s+-->\s+(?P<end>(?:\d+:)?\d+:\d+\.\d+)')
+    codec = VTT_TIME
+
+
+SUBTITLE_TYPES = {
+    '.ass': AssSubtitle,
+    '.ssa': AssSubtitle,
+    '.srt': SrtSubtitle,
+    '.vtt': VttSubtitle,
+}
+
+
+def get_subtitle_type(path) -> type[TextSubtitle]:
+    suffix = Path(path).suffix.lower()
+    if suffix not in SUBTITLE_TYPES:
+        raise ValueError(f'not supported subtitle type: {suffix}')
+    return SUBTITLE_TYPES[suffix]
+
+
+def open_subtitle(path, encoding='utf-8', name=None) -> TextSubtitle:
+    return get_subtitle_type(path)(path, encoding, name)
+
+
+def retime_subtitle(path, mapping: TimeMapping, name=None, keep_name=False, encoding='utf-8'):
+    """streaming retime of any supported subtitle file"""
+    return get_subtitle_type(path).retime(path, mapping, name, keep_name, encoding)
+
+
+import subprocess
+
+VIDEO_SUFFIXES = ['.mkv', '.mp4']
+# frame rate conversions between releases(PAL speedup, 24/23.976)
+FRAME_RATE_RATIOS = [1.0, 25 / 23.976, 23.976 / 25, 24 / 23.976, 23.976 / 24, 25 / 24, 24 / 25]
+
+
+def extract_audio(video, sample_rate=8000, ffmpeg_exec=None) -> np.ndarray:
+    """decode mono int16 audio at sample_rate using ffmpeg"""
+    command = [ffmpeg_exec or 'ffmpeg', '-nostdin', '-v', 'error', '-i', str(video),
+               '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-']
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def voice_activity(samples: np.ndarray, sample_rate, frame_rate=100) -> np.ndarray:
+    """0/1 voice activity per frame, frames with log energy(of the high-passed signal) above an adaptive threshold"""
+    hop = sample_rate // frame_rate
+    frames = samples[:len(samples) // hop * hop].astype(np.float64).reshape(-1, hop)
+    # first difference as a cheap high-pass, cuts most of the music bass
+    energy = np.log10(np.mean(np.square(np.diff(frames, axis=1)), axis=1) + 1e-6)
+    low, high = np.percentile(energy, [10, 90])
+    active = (energy > (low + high) / 2).astype(np.float64)
+    # close short gaps between words
+    return (np.convolve(active, np.ones(frame_rate // 4) / (frame_rate // 4), mode='same') > 0.3).astype(np.float64)
+
+
+def cue_activity(starts: np.ndarray, ends: np.ndarray, frame_rate, length) -> np.ndarray:
+    """0/1 per frame, 1 while any cue is shown"""
+    marks = np.zeros(length + 1)
+    np.add.at(marks, np.clip(np.rint(starts * frame_rate).astype(np.int64), 0, length), 1)
+    np.add.at(marks, np.clip(np.rint(ends * frame_rate).astype(np.int64), 0, length), -1)
+    return (np.cumsum(marks[:length]) > 0).astype(np.float64)
+
+
+def best_lag(signal: np.ndarray, reference: np.ndarray, max_lag):
+    """lag(in frames) of reference that correlates best with signal, and the normalized correlation, FFT based"""
+    a, b = signal - signal.mean(), reference - reference.mean()
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    if norm == 0:
+        return 0, 0.
+    # zero padded to avoid circular wrap-around for every lag in range
+    n = 1 << (len(a) + len(b)).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(a, n) * np.conj(np.fft.rfft(b, n)), n)
+    lags = np.arange(-min(max_lag, len(b) - 1), min(max_lag, len(a) - 1) + 1)
+    i = int(np.argmax(corr[lags]))
+    return int(lags[i]), float(corr[lags[i]] / norm)
+
+
+def estimate_sync_from_activity(starts, ends, voice: np.ndarray, frame_rate=100, max_offset=60.,
+                                scales=FRAME_RATE_RATIOS):
+    """
+    Find t -> scale * t + shift lining the cues up with the voice activity,
+    every candidate scale costs one FFT cross-correlation. Returns (TimeMapping, score).
+    """
+    if len(starts) == 0:
+        raise ValueError('no cues to sync')
+    best = None
+    for scale in scales:
+        length = max(len(voice), int(np.max(ends) * scale * frame_rate) + 1)
+        cues = cue_activity(starts * scale, ends * scale, frame_rate, length)
+        lag, score = best_lag(voice, cues, int(max_offset * frame_rate))
+        if best is None or score > best[2]:
+            best = scale, lag / frame_rate, score
+    scale, shift, score = best
+    return TimeMapping.linear(0., shift, 1., scale + shift), score
+
+
+def estimate_sync(subtitle: Subtitle, video, frame_rate=100, sample_rate=8000, max_offset=60.,
+                  scales=FRAME_RATE_RATIOS, ffmpeg_exec=None):
+    """
+    Estimate the mapping that syncs subtitle to the speech in video, returns (TimeMapping, score).
+    The score is the normalized correlation of cues and voice activity(1 at most), below ~0.2 is suspicious.
+    """
+    voice = voice_activity(extract_audio(video, sample_rate, ffmpeg_exec), sample_rate, frame_rate)
+    starts, ends = subtitle.times()
+    return estimate_sync_from_activity(starts, ends, voice, frame_rate, max_offset, scales)
+
+
+def find_video(path: Path):
+    """video next to the subtitle, whose name is the longest prefix of the subtitle name"""
+    videos = [v for v in path.parent.iterdir() if v.suffix.lower() in VIDEO_SUFFIXES and path.stem.startswith(v.stem)]
+    if not videos:
+        raise FileNotFoundError(f'no video found for {path.name}')
+    return max(videos, key=lambda v: len(v.stem))
+
+
+import argparse
+import time
+from multiprocessing import Pool
+
+
+def parse_time_argument(s: str) -> float:
+    """'1.5', '-2', '00:01:02.50' or '-00:00:01.00' to seconds"""
+    sign = -1 if s.startswith('-') else 1
+    s = s.lstrip('+-')
+    return sign * (string_to_seconds(s) if ':' in s else float(s))
+
+
+def is_up_to_date(path: Path, output: Path):
+    return output != path and output.is_file() and output.stat().st_mtime >= path.stat().st_mtime
+
+
+def retime_file(path: Path, mapping: Optional[TimeMapping], keep_name, encoding, ffmpeg_exec=None):
+    """
+    worker for the batch CLI, mapping None means auto sync to the video next to it,
+    returns (path, input size, seconds used, error message or None, note)
+    """
+    start = time.perf_counter()
+    note = ''
+    try:
+        if mapping is None:
+            video = find_video(path)
+            mapping, score = estimate_sync(open_subtitle(path, encoding), video, ffmpeg_exec=ffmpeg_exec)
+            note = f', synced to {video.name}: {mapping}, score {score:.2f}'
+        retime_subtitle(path, mapping, keep_name=keep_name, encoding=encoding)
+    except Exception as e:
+        return path, 0, time.perf_counter() - start, str(e), note
+    return path, path.stat().st_size, time.perf_counter() - start, None, note
+
+
+def _retime_file_star(work):
+    return retime_file(*work)
+
+
+def run(args):
+    root = Path(args.root)
+    if args.auto_sync:
+        mapping = None
+    elif args.scale:
+        mapping = TimeMapping.linear(*map(parse_time_argument, args.scale))
+    else:
+        mapping = TimeMapping.shifted(parse_time_argument(args.shift))
+    suffixes = {s.lower() for s in args.suffixes} if args.suffixes else set(SUBTITLE_TYPES)
+
+    works, skipped = [], 0
+    for path in sorted(root.rglob('*') if root.is_dir() else [root]):
+        if path.suffix.lower() not in suffixes or not path.is_file() or path.stem.endswith('_shifted'):
+            continue
+        if not args.force and is_up_to_date(path, get_output_path(path, keep_name=args.keep_name)):
+            skipped += 1
+            continue
+        works.append((path, mapping, args.keep_name, args.encoding, args.ffmpeg_exec))
+
+    total_size, failed = 0, 0
+    start = time.perf_counter()
+    # multiprocessing go🚀
+    with Pool(args.jobs) as p:
+        for path, size, used, error, note in p.imap_unordered(_retime_file_star, works):
+            if error:
+                failed += 1
+                print(f'FAIL: {path}, {error}')
+                continue
+            total_size += size
+            print(f'OK: {path}, {size / 1e6:.2f}MB in {used:.3f}s, {size / 1e6 / max(used, 1e-9):.1f}MB/s{note}')
+    used = time.perf_counter() - start
+
+    print(f'{len(works) - failed} retimed, {skipped} up to date, {failed} failed, '
+          f'{total_size / 1e6:.2f}MB in {used:.2f}s, {total_size / 1e6 / max(used, 1e-9):.1f}MB/s')
+    print('SUCCESS!' if not failed else 'OOPS!')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='retime all subtitles under a directory')
+    parser.add_argument('root', type=str, help='subtitle directory(searched recursively) or a single file')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-s', '--shift', type=str,
+                       help='seconds or H:MM:SS.cc to delay(negative to advance) all cues, e.g. -s -1.5')
+    group.add_argument('--scale', type=str, nargs=4, metavar=('t1', 't1_new', 't2', 't2_new'),
+                       help='two point linear scale, t1 -> t1_new and t2 -> t2_new')
+    group.add_argument('--auto-sync', action='store_true',
+                       help='estimate shift/scale from the speech of the video next to each subtitle(FFmpeg required)')
+    parser.add_argument('--suffixes', type=str, action='extend', nargs='*',
+                        help=f'subtitle suffixes to process, default:{list(SUBTITLE_TYPES)}')
+    parser.add_argument('--keep-name', default=False, action=argparse.BooleanOptionalAction,
+                        help='overwrite original files instead of writing *_shifted files')
+    parser.add_argument('-f', '--force', default=False, action=argparse.BooleanOptionalAction,
+                        help='process files even if the output is newer than the input')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, default: cpu count')
+    parser.add_argument('--encoding', type=str, default='utf-8', help='subtitle file encoding')
+    parser.add_argument('--ffmpeg_exec', type=str, help='specify a ffmpeg executable')
+    args = parser.parse_args()
+    print(args)
+
+    run(args)